@@ -1,7 +1,8 @@
 from rest_framework import generics, permissions
 from rest_framework.response import Response
 from knox.models import AuthToken
-from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from .backends import EMAIL_INDEX, email_lookup
 from .serializers import UserSerializer, RegisterSerializer, LoginSerializer
 from rest_framework.status import HTTP_403_FORBIDDEN
 
@@ -12,13 +13,18 @@ class RegisterAPI(generics.GenericAPIView):
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        email = request.data.get("email", None)
 
-        check_user = User.objects.filter(email=email).first()
-        if check_user:
-            return Response({"error": "Email already exists. Please try another one"}, status=HTTP_403_FORBIDDEN)
-
-        user = serializer.save()
+        email_taken = Response({"error": "Email already exists. Please try another one"}, status=HTTP_403_FORBIDDEN)
+        if email_lookup(serializer.validated_data["email"]).exists():
+            return email_taken
+        # A concurrent sign-up with the same email loses on the unique index.
+        try:
+            with transaction.atomic():
+                user = serializer.save()
+        except IntegrityError as exc:
+            if EMAIL_INDEX not in str(exc):
+                raise
+            return email_taken
         return Response({
             "user": UserSerializer(user, context=self.get_serializer_context()).data,
             "token": AuthToken.objects.create(user)[1]
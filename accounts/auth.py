@@ -0,0 +1,123 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from copy import copy
+
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from knox.auth import TokenAuthentication
+from knox.models import AuthToken
+from knox.settings import knox_settings
+
+
+class TokenCache:
+    # Bounded LRU of verified tokens -> (user, auth token). Entries live for
+    # `ttl` seconds at most and never past the token's own expiry. The cache is
+    # per process; revocations made in other processes are seen through the
+    # shared markers checked by CachedTokenAuthentication.
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            user, auth_token, expires = entry
+            if expires <= self.clock():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return user, auth_token
+
+    def set(self, key, user, auth_token):
+        lifetime = self.ttl
+        if auth_token.expiry is not None:
+            lifetime = min(lifetime, (auth_token.expiry - timezone.now()).total_seconds())
+        if lifetime <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (user, auth_token, self.clock() + lifetime)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard(self, predicate):
+        with self.lock:
+            for key in [
+                key
+                for key, (user, auth_token, _) in self.entries.items()
+                if predicate(user, auth_token)
+            ]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_CACHE_TTL)
+
+
+def revoked_token_key(digest):
+    return "knox:revoked:" + digest
+
+
+def changed_user_key(user_pk):
+    return "knox:user-changed:{pk}".format(pk=user_pk)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # knox looks up candidate tokens by prefix, hashes the token with each
+    # salt and loads the user on every request; a verified token is served
+    # from token_cache instead until it expires or is deleted.
+    #
+    # Deleted tokens and changed users are also marked in the shared cache for
+    # AUTH_TOKEN_CACHE_TTL, the longest an entry lives, so that every process
+    # stops serving them from its own cache: while marked they are verified
+    # against the database on each request.
+    cache = token_cache
+
+    def authenticate_credentials(self, token):
+        key = hashlib.sha256(token).hexdigest()
+        cached = self.cache.get(key)
+        if cached is not None and not self.revoked(*cached):
+            user, auth_token = cached
+            if knox_settings.AUTO_REFRESH and auth_token.expiry:
+                self.renew_token(auth_token)
+            # Requests get their own copies; the cached instances stay untouched.
+            return copy(user), copy(auth_token)
+        user, auth_token = super().authenticate_credentials(token)
+        if not self.revoked(user, auth_token):
+            self.cache.set(key, user, auth_token)
+        return user, auth_token
+
+    def revoked(self, user, auth_token):
+        return bool(
+            shared_cache.get_many([revoked_token_key(auth_token.digest), changed_user_key(user.pk)])
+        )
+
+
+@receiver(post_delete, sender=AuthToken)
+def auth_token_deleted(sender, instance, **kwargs):
+    # Logout, logout-all and knox's expired token cleanup all delete tokens.
+    shared_cache.set(revoked_token_key(instance.digest), True, settings.AUTH_TOKEN_CACHE_TTL)
+    token_cache.discard(lambda user, auth_token: auth_token.digest == instance.digest)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    # Deactivated users and changed details are picked up on the next request.
+    # Nothing is cached for a new user, and logins only touch last_login.
+    if not created and update_fields != frozenset(["last_login"]):
+        shared_cache.set(changed_user_key(instance.pk), True, settings.AUTH_TOKEN_CACHE_TTL)
+    token_cache.discard(lambda user, auth_token: user.pk == instance.pk)
@@ -0,0 +1,42 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.db.models import CharField, Func
+from django.db.models.functions import Lower
+
+
+# Unique index on auth_user (NULLIF(LOWER(email), '')), see the accounts
+# migrations.
+EMAIL_INDEX = "accounts_user_email_lower_uniq"
+
+
+class EmailKey(Func):
+    # The expression of EMAIL_INDEX, rendered verbatim (no bound '') so the
+    # database can match it to the index.
+    template = "NULLIF(%(expressions)s, '')"
+    output_field = CharField()
+
+    def __init__(self):
+        super().__init__(Lower("email"))
+
+
+def email_lookup(email):
+    return User.objects.annotate(email_key=EmailKey()).filter(email_key=email.lower())
+
+
+class EmailBackend(ModelBackend):
+    # Authenticates by email with one user query. Username credentials, as the
+    # admin sends them, fall through to ModelBackend.
+    def authenticate(self, request, username=None, password=None, email=None, **kwargs):
+        if email is None:
+            return super().authenticate(request, username, password, **kwargs)
+        if not email or password is None:
+            return None
+        user = email_lookup(email).first()
+        if user is None:
+            # Hash anyway so unknown emails take as long as wrong passwords.
+            User().set_password(password)
+            return None
+        # check_password() also rehashes the password if the hasher changed.
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
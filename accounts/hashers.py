@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    # Same algorithm and hash format as Django's, with the work factor taken
+    # from PASSWORD_HASH_ITERATIONS. Stored hashes with a different count are
+    # rewritten by check_password() on the user's next login.
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS or super().iterations
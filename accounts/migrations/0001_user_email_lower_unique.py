@@ -0,0 +1,38 @@
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_duplicate_emails(apps, schema_editor):
+    # Accounts sharing an email need to be merged or renamed by hand first.
+    User = apps.get_model('auth', 'User')
+    duplicates = list(
+        User.objects.exclude(email='')
+        .annotate(email_lower=Lower('email'))
+        .values_list('email_lower', flat=True)
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+    )
+    if duplicates:
+        raise RuntimeError(
+            'Emails used by more than one account: %s' % ', '.join(sorted(duplicates))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        # Django 3.1 indexes cannot hold expressions, so this is raw SQL. Blank
+        # emails index as NULL, which never collides, so accounts created
+        # without one may share it.
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX accounts_user_email_lower_uniq "
+            "ON auth_user (NULLIF(LOWER(email), ''))",
+            "DROP INDEX accounts_user_email_lower_uniq",
+        ),
+    ]
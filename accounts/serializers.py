@@ -13,7 +13,11 @@ class RegisterSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'password')
-        extra_kwargs = {'password': {'write_only': True}}
+        # Users log in by email, so every account needs one.
+        extra_kwargs = {
+            'password': {'write_only': True},
+            'email': {'required': True, 'allow_blank': False},
+        }
 
     def create(self, validated_data):
         user = User.objects.create_user(validated_data
@@ -27,12 +31,8 @@ class LoginSerializer(serializers.Serializer):
     password = serializers.CharField()
 
     def validate(self, data):
-        check_user = User.objects.filter(email=data['email']).first()
-        if check_user is None:
-            raise serializers.ValidationError("Incorrect Credentials")
-        username = check_user.username
-        user = authenticate(username=username, password=data['password'])
-        # user = authenticate(**data)
-        if user and user.is_active:
+        # accounts.backends.EmailBackend, one user query.
+        user = authenticate(email=data['email'], password=data['password'])
+        if user:
             return user
         raise serializers.ValidationError("Incorrect Credentials")
\ No newline at end of file
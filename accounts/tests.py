@@ -1,3 +1,191 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from knox.models import AuthToken
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from .auth import CachedTokenAuthentication, TokenCache, token_cache
+from .backends import email_lookup
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = User.objects.create_user("shopper", "shopper@example.com", "secret")
+        self.auth_token, self.token = AuthToken.objects.create(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token)
+
+    def get_user(self):
+        return self.client.get("/api/auth/user")
+
+    def test_verified_tokens_skip_the_database(self):
+        self.assertEqual(self.get_user().json()["username"], "shopper")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_user().json()["username"], "shopper")
+
+    def test_wrong_tokens_are_rejected(self):
+        self.get_user()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + "0" * 64)
+        self.assertEqual(self.get_user().status_code, 401)
+
+    def test_logout_evicts_the_token(self):
+        self.get_user()
+        self.assertEqual(self.client.post("/api/auth/logout").status_code, 204)
+        self.assertEqual(self.get_user().status_code, 401)
+
+    def test_deactivated_users_are_rejected(self):
+        self.get_user()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_user().status_code, 401)
+
+    def test_revocations_reach_other_processes(self):
+        # Another process with its own cache of verified tokens.
+        other = CachedTokenAuthentication()
+        other.cache = TokenCache(max_size=16, ttl=60)
+        token = self.token.encode()
+        self.assertEqual(other.authenticate_credentials(token)[0], self.user)
+        with self.assertNumQueries(0):
+            other.authenticate_credentials(token)
+        self.user.first_name = "Renamed"
+        self.user.save()
+        self.assertEqual(other.authenticate_credentials(token)[0].first_name, "Renamed")
+        self.assertEqual(self.client.post("/api/auth/logout").status_code, 204)
+        with self.assertRaises(AuthenticationFailed):
+            other.authenticate_credentials(token)
+
+    def test_entries_never_outlive_the_token(self):
+        AuthToken.objects.filter(pk=self.auth_token.pk).update(
+            expiry=timezone.now() + timedelta(milliseconds=1)
+        )
+        self.get_user()
+        AuthToken.objects.filter(pk=self.auth_token.pk).update(
+            expiry=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(self.get_user().status_code, 401)
+        self.assertFalse(AuthToken.objects.exists())
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = TokenCache(max_size=2, ttl=60, clock=lambda: self.now)
+        self.user = User(pk=1, username="shopper")
+
+    def token(self, digest, expiry=None):
+        return AuthToken(digest=digest, user=self.user, expiry=expiry)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for key in ("a", "b"):
+            self.cache.set(key, self.user, self.token(key))
+        self.cache.get("a")
+        self.cache.set("c", self.user, self.token("c"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("c"))
+
+    def test_entries_expire(self):
+        self.cache.set("a", self.user, self.token("a"))
+        self.cache.set("b", self.user, self.token("b", timezone.now() + timedelta(seconds=10)))
+        self.cache.set("c", self.user, self.token("c", timezone.now() - timedelta(seconds=1)))
+        self.now = 30
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNone(self.cache.get("c"))
+        self.now = 61
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_discard(self):
+        self.cache.set("a", self.user, self.token("a"))
+        self.cache.set("b", self.user, self.token("b"))
+        self.cache.discard(lambda user, auth_token: auth_token.digest == "a")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("b"))
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class EmailLoginTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = User.objects.create_user("shopper", "Shopper@Example.com", "secret")
+
+    def login(self, email, password="secret"):
+        return self.client.post("/api/auth/login", {"email": email, "password": password})
+
+    def test_login_is_case_insensitive(self):
+        response = self.login("shopper@example.COM")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["user"]["username"], "shopper")
+
+    def test_login_looks_the_user_up_once(self):
+        # The user lookup and the token insert.
+        with self.assertNumQueries(2):
+            self.assertEqual(self.login("shopper@example.com").status_code, 200)
+
+    def test_bad_credentials_are_rejected(self):
+        self.assertEqual(self.login("shopper@example.com", "wrong").status_code, 400)
+        self.assertEqual(self.login("nobody@example.com").status_code, 400)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.login("shopper@example.com").status_code, 400)
+
+    def test_passwords_are_rehashed_at_the_configured_cost(self):
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$1000$"))
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertEqual(self.login("shopper@example.com").status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$2000$"))
+        self.assertEqual(self.login("shopper@example.com").status_code, 200)
+
+    def test_email_lookup_uses_the_index(self):
+        queryset = email_lookup("shopper@example.com")
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("accounts_user_email_lower_uniq", plan)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class RegisterTests(TestCase):
+    def register(self, username, email):
+        return self.client.post(
+            "/api/auth/register",
+            {"username": username, "email": email, "password": "secret"},
+        )
+
+    def test_register(self):
+        response = self.register("shopper", "shopper@example.com")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("token", response.json())
+
+    def test_emails_are_unique_regardless_of_case(self):
+        self.register("shopper", "shopper@example.com")
+        response = self.register("other", "SHOPPER@example.com")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_concurrent_sign_ups_lose_on_the_index(self):
+        self.register("shopper", "shopper@example.com")
+        # The other request checked before this one inserted.
+        with mock.patch("accounts.api.email_lookup", return_value=User.objects.none()):
+            response = self.register("other", "Shopper@example.com")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_email_is_required(self):
+        self.assertEqual(self.register("shopper", "").status_code, 400)
+
+    def test_accounts_without_email_may_coexist(self):
+        User.objects.create_user("admin")
+        User.objects.create_user("staff")
+        self.assertEqual(User.objects.filter(email="").count(), 2)
@@ -1,7 +1,14 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
 from django.shortcuts import render, get_object_or_404
 from rest_framework.views import APIView
 from rest_framework import viewsets
-import random
 from rest_framework.generics import (
     ListAPIView,
     RetrieveAPIView,
@@ -12,18 +19,43 @@ from rest_framework.generics import (
 )
 from rest_framework.permissions import AllowAny, IsAuthenticated
 
-from rest_framework.decorators import parser_classes, renderer_classes
+from rest_framework.decorators import action, parser_classes, renderer_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.parsers import JSONParser
 from rest_framework.renderers import JSONOpenAPIRenderer, JSONRenderer
-from .pagination import CustomPagination
-from .models import Product, OrderItem, Address, Order, Wishlist
+from .facets import catalog_facets, facet_counts
+from .filters import ProductFilterSet
+from .pagination import (
+    CustomPagination,
+    OrderKeysetPagination,
+    ProductKeysetPagination,
+    KEYSET_COLUMNS,
+    NON_COUNT_PARAMS,
+)
+from .search import ProductSearchFilter
+from .suggest import suggest
+from .cache import catalog_version, normalized_query, product_cache
+from .cart import (
+    load_cart,
+    cart_data,
+    checkout,
+    add_to_cart,
+    apply_cart_operations,
+    CartError,
+    CheckoutError,
+    InvalidQuantity,
+)
+from .models import Product, OrderItem, Address, Order, OrderLine, Wishlist
 from .serializers import (
     ProductSerializer,
+    ProductListSerializer,
     OrderItemSerializer,
+    CartBatchSerializer,
     AddressSerializer,
     OrderSerializer,
     WishlistSerializer,
+    compiled_values_serializer,
 )
 from rest_framework.status import (
     HTTP_200_OK,
@@ -31,37 +63,245 @@ from rest_framework.status import (
     HTTP_403_FORBIDDEN,
     HTTP_201_CREATED,
     HTTP_204_NO_CONTENT,
+    HTTP_304_NOT_MODIFIED,
+    HTTP_404_NOT_FOUND,
 )
 
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.filters import OrderingFilter
+
+class SparseFieldsViewMixin:
+    # ?fields=a,b,c returns only those fields of each object
+    fields_query_param = "fields"
+
+    def get_requested_fields(self):
+        fields = self.request.query_params.get(self.fields_query_param)
+        if not fields:
+            return None
+        return [field.strip() for field in fields.split(",") if field.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs["fields"] = fields
+        return super().get_serializer(*args, **kwargs)
+
+
+class ProductListMixin(SparseFieldsViewMixin):
+    # Lists use the compact serializer unless specific fields are requested
+    def get_serializer_class(self):
+        if self.get_requested_fields() is not None:
+            return ProductSerializer
+        return ProductListSerializer
+
+    def get_values_serializer(self):
+        fields = self.get_requested_fields()
+        return compiled_values_serializer(
+            self.get_serializer_class(), tuple(fields) if fields is not None else None
+        )
+
+    def list(self, request, *args, **kwargs):
+        # Read-only rows go through .values() and a precompiled field mapping
+        # instead of a ModelSerializer per instance; the output is identical.
+        serializer = self.get_values_serializer()
+        columns = set(serializer.columns) | set(KEYSET_COLUMNS)
+        queryset = self.filter_queryset(self.get_queryset()).values(*columns)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            response = self.get_paginated_response(serializer.serialize(page, request))
+            # Set by ProductSearchFilter: whether results are in relevance order.
+            if hasattr(self, "search_ranked"):
+                response.data["ranked"] = self.search_ranked
+            return response
+        return Response(serializer.serialize(queryset, request))
+
+
+class CatalogCacheMixin:
+    # Public catalog responses only change with the catalog version, so they
+    # are cached rendered and validated with ETag/Last-Modified. Cache hits and
+    # requests with a matching ETag are answered without touching the
+    # database; authentication is skipped as nothing here depends on the user.
+    authentication_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        version = catalog_version()
+        digest = hashlib.md5(
+            "{version}:{host}:{format}:{query}".format(
+                version=version,
+                host=request.get_host(),
+                format=request.accepted_renderer.format,
+                query=normalized_query(request),
+            ).encode()
+        ).hexdigest()
+        self.catalog_cache_key = "catalog:response:" + digest
+        self.catalog_etag = '"{digest}"'.format(digest=digest)
+        # Last-Modified has whole seconds only. It is left out until the
+        # version's second is over, so a later write in that same second can
+        # never hide behind an unchanged value.
+        modified = int(version // 1000)
+        self.catalog_last_modified = modified if int(time.time()) > modified else None
+
+        # Only 200s carry the ETag, so a match also proves the resource exists.
+        if self.catalog_etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            return Response(status=HTTP_304_NOT_MODIFIED)
+
+        cached = cache.get(self.catalog_cache_key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+        return super().get(request, *args, **kwargs)
+
+    def not_modified(self, request):
+        # For `If-None-Match: *` and If-Modified-Since, which say nothing about
+        # whether the resource exists; only asked once it is known to.
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match is not None:
+            return "*" in parse_etags(if_none_match)
+        since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+        return (
+            since is not None
+            and self.catalog_last_modified is not None
+            and since >= self.catalog_last_modified
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, "catalog_cache_key", None) is None:
+            return response
+        if response.status_code == HTTP_200_OK and isinstance(response, Response):
+            response.render()
+            cache.set(
+                self.catalog_cache_key,
+                (response.content, response["Content-Type"]),
+                settings.CATALOG_RESPONSE_CACHE_TIMEOUT,
+            )
+        if response.status_code == HTTP_200_OK and self.not_modified(request):
+            response = HttpResponse(status=HTTP_304_NOT_MODIFIED)
+        if response.status_code in (HTTP_200_OK, HTTP_304_NOT_MODIFIED):
+            response["ETag"] = self.catalog_etag
+            if self.catalog_last_modified is not None:
+                response["Last-Modified"] = http_date(self.catalog_last_modified)
+            response["Cache-Control"] = "public, no-cache"
+        return response
+
 
 # Product List
-class ProductListView(ListAPIView):
-    serializer_class = ProductSerializer
-    queryset = Product.objects.all()
+class ProductListView(CatalogCacheMixin, ProductListMixin, ListAPIView):
+    serializer_class = ProductListSerializer
+    queryset = Product.objects.order_by("id")
     permission_classes = (AllowAny,)
+    pagination_class = CustomPagination
+    export_chunk_size = 500
+
+    def list(self, request, *args, **kwargs):
+        # ?export=1 streams the whole catalog as one JSON array, reading and
+        # encoding it a chunk at a time; otherwise the catalog is paginated.
+        if request.query_params.get("export") not in ("1", "true"):
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_values_serializer()
+        rows = (
+            self.filter_queryset(self.get_queryset())
+            .values(*serializer.columns)
+            .iterator(chunk_size=self.export_chunk_size)
+        )
+        return StreamingHttpResponse(
+            self.stream_json_array(serializer, rows, request),
+            content_type="application/json",
+        )
+
+    def stream_json_array(self, serializer, rows, request):
+        renderer = JSONRenderer()
+        yield b"["
+        separator = b""
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == self.export_chunk_size:
+                yield separator + renderer.render(serializer.serialize(chunk, request))[1:-1]
+                separator = b","
+                chunk = []
+        if chunk:
+            yield separator + renderer.render(serializer.serialize(chunk, request))[1:-1]
+        yield b"]"
 
 
 # Product List Custom
-class ProductListCustomView(ListAPIView):
-    serializer_class = ProductSerializer
+class ProductListCustomView(CatalogCacheMixin, ProductListMixin, ListAPIView):
+    serializer_class = ProductListSerializer
     queryset = Product.objects.all()
     permission_classes = (AllowAny,)
     pagination_class = CustomPagination
-    filter_backends = (DjangoFilterBackend, OrderingFilter, SearchFilter, )
-    filter_fields = ('category',)
-    ordering_fields = ('price',)
+    filter_backends = (DjangoFilterBackend, OrderingFilter, ProductSearchFilter, )
+    filterset_class = ProductFilterSet
+    ordering_fields = ('price', 'effective_price', 'discount_pct', 'created_at')
     search_fields = ('product_name', )
 
+    facets_query_param = "facets"
+    # Parameters that leave the set of matching products untouched
+    unfiltered_params = NON_COUNT_PARAMS + ("facets", "fields", "format")
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get(self.facets_query_param) in ("1", "true"):
+            response.data["facets"] = self.get_facets(request)
+        return response
+
+    def get_facets(self, request):
+        # The whole catalog is counted from the maintained facet table, any
+        # filtered or searched subset with one grouped query.
+        if all(key in self.unfiltered_params for key in request.query_params):
+            return catalog_facets()
+        return facet_counts(self.filter_queryset(self.get_queryset()))
+
+    @property
+    def paginator(self):
+        # ?pagination=keyset switches to cursor pages that cost the same at any depth
+        if not hasattr(self, "_paginator"):
+            if self.request.query_params.get("pagination") == "keyset":
+                self._paginator = ProductKeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+
+# Typeahead suggestions
+class ProductSuggestView(APIView):
+    permission_classes = (AllowAny,)
+    max_limit = 20
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get("limit", 8))
+        except ValueError:
+            limit = 8
+        limit = max(1, min(limit, self.max_limit))
+        results = [
+            {
+                "slug": slug,
+                "product_name": name,
+                "thumbnail": request.build_absolute_uri(settings.MEDIA_URL + image)
+                if image
+                else None,
+            }
+            for slug, name, image in suggest(request.query_params.get("q", ""), limit)
+        ]
+        return Response({"results": results}, status=HTTP_200_OK)
+
 
 # Retrieve a Product
-class ProductRetrieveView(RetrieveAPIView):
+class ProductRetrieveView(CatalogCacheMixin, SparseFieldsViewMixin, RetrieveAPIView):
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
     permission_classes = (AllowAny,)
     lookup_field = "slug"
 
+    def get_object(self):
+        product = product_cache.get_by_slug(self.kwargs[self.lookup_field])
+        if product is None:
+            raise Http404
+        self.check_object_permissions(self.request, product)
+        return product
+
 
 # Create an Order Item
 class CreateOrderItem(CreateAPIView):
@@ -81,23 +321,15 @@ class AddToCartView(APIView):
             return Response(
                 {"error": "Product does not exist"}, status=HTTP_400_BAD_REQUEST
             )
-        order_item = OrderItem.objects.filter(
-            user=self.request.user, product=product, is_ordered=False
-        ).first()
-        quantity = int(request.data.get("quantity"))
-        if order_item is not None:
-            quantity += order_item.quantity
-            if quantity > 5:
-                return Response(
-                    {"message": "Maximum quantity is limited to 5"},
-                    status=HTTP_400_BAD_REQUEST,
-                )
-            order_item.quantity = quantity
-            order_item.save()
-        else:
-            order_item = OrderItem.objects.create(
-                user=request.user, product=product, quantity=quantity
+        try:
+            quantity = int(request.data.get("quantity", 1))
+            order_item = add_to_cart(request.user, product, quantity)
+        except (TypeError, ValueError):
+            return Response(
+                {"message": InvalidQuantity.message}, status=HTTP_400_BAD_REQUEST
             )
+        except CartError as e:
+            return Response({"message": e.message}, status=HTTP_400_BAD_REQUEST)
         serializer = OrderItemSerializer(order_item)
         return Response(data=serializer.data, status=HTTP_201_CREATED)
 
@@ -165,36 +397,24 @@ class CartItemsView(APIView):
     serializer_class = OrderItemSerializer
 
     def get(self, request):
-        cart_items_res = []
-        cart_items = OrderItem.objects.filter(user=request.user, is_ordered=False).all()
-        total_items = 0
-        for item in cart_items:
-            item_res = {
-                "id": item.id,
-                "product_id": item.product.id,
-                "product_name": item.product.product_name,
-                "slug": item.product.slug,
-                "price": item.product.price,
-                "discount": item.product.discount,
-                "quantity": item.quantity,
-                "image": "http://" + request.META["HTTP_HOST"] + "/media/" + str(item.product.image1),
-                "total_price": round(
-                    item.quantity * (item.product.price - item.product.discount), 2
-                ),
-            }
-            total_items += item.quantity
-            cart_items_res.append(item_res)
+        return Response(cart_data(request, load_cart(request.user)), status=HTTP_200_OK)
 
-        total_cart_amount, total_cart_savings = OrderItem.total_cart_amount(self)
-        return Response(
-            {
-                "cartItems": cart_items_res,
-                "cartTotal": round(total_cart_amount, 2),
-                "cartSavings": round(total_cart_savings, 2),
-                "cartCount": total_items,
-            },
-            status=HTTP_200_OK,
-        )
+
+# Several cart changes in one request ----
+class CartBatchView(APIView):
+    parser_classes = [JSONParser]
+    renderer_classes = [JSONOpenAPIRenderer]
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=HTTP_400_BAD_REQUEST)
+        try:
+            apply_cart_operations(request.user, serializer.validated_data["operations"])
+        except CartError as e:
+            return Response({"message": e.message}, status=HTTP_400_BAD_REQUEST)
+        return Response(cart_data(request, load_cart(request.user)), status=HTTP_200_OK)
 
 
 class AddressViewSet(viewsets.ModelViewSet):
@@ -216,122 +436,136 @@ class OrderView(APIView):
     permission_classes = (IsAuthenticated,)
 
     def post(self, request, *args, **kwargs):
-        order_id = "ODR{num}".format(num=str(random.randrange(100000, 1000000)))
-        order_items = OrderItem.objects.filter(
-            user=request.user, is_ordered=False
-        ).all()
-
-        if order_items is None:
+        try:
+            address = Address.objects.filter(
+                pk=request.data.get("address_id"), user=request.user
+            ).first()
+        except (TypeError, ValueError):
+            address = None
+        if address is None:
             return Response(
-                {"message": "There are no items in your cart"},
-                status=HTTP_400_BAD_REQUEST,
+                {"message": "Address does not exist"}, status=HTTP_400_BAD_REQUEST
             )
 
-        total_cart_amount, total_cart_savings = OrderItem.total_cart_amount(self)
-
-        item_count = 0;
-        for item in order_items:
-            item.is_ordered = True
-            item.order_id = order_id
-            item_count += item.quantity
-            item.save()
-
-        coupon_name = request.data.get("coupon")
-        if coupon_name == "INSTANT10":
-            coupon_amount = round(total_cart_amount * 0.1, 2)
-        else:
-            coupon_amount = 0
-
-        address = Address.objects.get(pk=request.data.get("address_id"))
-        order = Order.objects.create(
-            user=request.user,
-            order_id=order_id,
-            total_amount=round(total_cart_amount + total_cart_savings, 2),
-            total_items=item_count,
-            coupon=request.data.get("coupon"),
-            coupon_amount=coupon_amount,
-            order_amount=round(total_cart_amount - coupon_amount, 2),
-            savings=round(coupon_amount + total_cart_savings, 2),
-            address=address,
-        )
-        order.save()
+        try:
+            order = checkout(request.user, address, request.data.get("coupon"))
+        except CheckoutError as e:
+            return Response({"message": e.message}, status=HTTP_400_BAD_REQUEST)
+
         serializer = OrderSerializer(order)
         return Response(serializer.data, status=HTTP_201_CREATED)
 
 
-class OrderRetrieveView(APIView):
+class OrderRetrieveView(SparseFieldsViewMixin, APIView):
     permission_classes = (IsAuthenticated,)
     parser_classes = [JSONParser]
     renderer_classes = [JSONOpenAPIRenderer]
 
     def get(self, request, order_id, *args, **kwargs):
-        # order_id = request.data.get("order_id")
-        order = Order.objects.filter(order_id=order_id, user=request.user).first()
+        # One query for the order and its address, one for its lines; the
+        # lines carry their product snapshot, so no product rows are read.
+        order = (
+            Order.objects.filter(order_id=order_id, user=request.user)
+            .select_related("address")
+            .prefetch_related(
+                Prefetch("lines", queryset=OrderLine.objects.order_by("id"))
+            )
+            .first()
+        )
         if order is None:
             return Response(
                 {"message": "No matching orders found"}, status=HTTP_400_BAD_REQUEST
             )
 
-        order_items = OrderItem.objects.filter(order_id=order_id).all()
-        address = Address.objects.filter(pk=order.address.id)[0]
-
         order_items_res = []
-        for item in order_items:
+        for item in order.lines.all():
             item_res = {
                 "id": item.id,
-                "product_name": item.product.product_name,
-                "slug": item.product.slug,
-                "price": item.product.price,
-                "discount": item.product.discount,
+                "product_name": item.product_name,
+                "slug": item.product_slug,
+                "price": item.unit_price,
+                "discount": item.unit_discount,
                 "quantity": item.quantity,
-                "image": "http://" + request.META["HTTP_HOST"] + "/media/" + str(item.product.image1),
-                "total_price": item.quantity
-                * (item.product.price - item.product.discount),
+                "image": "http://" + request.META["HTTP_HOST"] + "/media/" + str(item.product_image),
+                "total_price": item.line_total,
             }
             order_items_res.append(item_res)
 
-        order_serializer = OrderSerializer(order)
-        address_serializer = AddressSerializer(address)
+        order_serializer = OrderSerializer(order, fields=self.get_requested_fields())
+        address = order.address
         return Response(
             {
                 "order": order_serializer.data,
                 "order_items": order_items_res,
-                "address": address_serializer.data,
+                "address": AddressSerializer(address).data if address is not None else None,
             },
             status=HTTP_200_OK,
         )
 
 
-class OrderListView(ListAPIView):
+class OrderListView(SparseFieldsViewMixin, ListAPIView):
     serializer_class = OrderSerializer
     permission_classes = (IsAuthenticated,)
     queryset = Order.objects.all()
+    pagination_class = OrderKeysetPagination
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return Order.objects.filter(user=self.request.user).order_by("-created_at")
 
 
-class WishlistViewSet(viewsets.ModelViewSet):
+class WishlistViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Wishlist.objects.all()
     serializer_class = WishlistSerializer
     permission_classes = (IsAuthenticated,)
+    max_membership_ids = 100
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user)
+        # One joined query, reading only the product columns that are shown.
+        return (
+            Wishlist.objects.filter(user=self.request.user)
+            .select_related("product")
+            .only(
+                "id",
+                "user",
+                "product",
+                *("product__" + field for field in ProductListSerializer.Meta.fields)
+            )
+            .order_by("id")
+        )
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        try:
+            with transaction.atomic():
+                serializer.save(user=self.request.user)
+        except IntegrityError:
+            raise ValidationError({"product": ["Product is already in the wishlist"]})
+
+    @action(detail=False, methods=["get"])
+    def contains(self, request):
+        # ?product_ids=1,2,3 -> the wishlist entries among those products, so
+        # a product grid can mark all of its hearts with one call.
+        try:
+            product_ids = {
+                int(pk) for pk in request.query_params.get("product_ids", "").split(",") if pk
+            }
+        except ValueError:
+            return Response(
+                {"message": "product_ids must be a list of ids"}, status=HTTP_400_BAD_REQUEST
+            )
+        if len(product_ids) > self.max_membership_ids:
+            return Response(
+                {"message": "At most {limit} product ids".format(limit=self.max_membership_ids)},
+                status=HTTP_400_BAD_REQUEST,
+            )
+        entries = Wishlist.objects.filter(
+            user=request.user, product__in=product_ids
+        ).values("id", "product")
+        return Response({"results": list(entries)}, status=HTTP_200_OK)
 
     def destroy(self, request, pk):
-        # if 1 != 2:
-        #     return Response({"message": "User not same  111"})
-        user = self.request.user
-        wishlist = Wishlist.objects.filter(pk=pk).first()
-        if wishlist is None:
-            return Response(data={"message": "Item is not present in wishlist"}, status=HTTP_400_BAD_REQUEST)
-        if user.id != wishlist.user_id:
-            return Response(data={"message": "Not Authorized"}, status=HTTP_403_FORBIDDEN)
-            # raise MyCustomExcpetion(detail={"message": "You are not the author of this blog"}, status_code=HTTP_403_FORBIDDEN)
-
-        wishlist.delete()
-        return Response(status=HTTP_204_NO_CONTENT)
\ No newline at end of file
+        # Scoped to the user in the DELETE itself; another user's entry looks
+        # exactly like a missing one.
+        deleted, _ = Wishlist.objects.filter(pk=pk, user=request.user).delete()
+        if not deleted:
+            return Response(data={"message": "Item is not present in wishlist"}, status=HTTP_404_NOT_FOUND)
+        return Response(status=HTTP_204_NO_CONTENT)
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Product
+
+
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+def catalog_version():
+    # Millisecond timestamp of the last product write; part of every catalog
+    # cache key, so bumping it invalidates all of them at once.
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def normalized_query(request, exclude=()):
+    # Order-independent digest of the path and query string.
+    params = sorted(
+        (key, sorted(values))
+        for key, values in request.query_params.lists()
+        if key not in exclude
+    )
+    return hashlib.md5(json.dumps([request.path, params]).encode()).hexdigest()
+
+
+def bump_catalog_version():
+    version = max(int(time.time() * 1000), (cache.get(CATALOG_VERSION_KEY) or 0) + 1)
+    cache.set(CATALOG_VERSION_KEY, version, None)
+    return version
+
+
+MISSING = "product:missing"
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2
+
+
+class ProductCache:
+    # Read-through cache for single products, looked up by id or slug.
+    #
+    # Each product has its own version counter and entries are stored under
+    # the version that was current before the database read, so a recompute
+    # that races with an invalidation can only write a key nobody reads any
+    # more. Concurrent misses for the same key are collapsed into one database
+    # query: threads wait on a striped in-process lock, other processes on a
+    # lock entry in the cache.
+    def __init__(self, cache=cache, timeout=None, stripes=64):
+        self.cache = cache
+        self.timeout = timeout
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._counter_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_timeout(self):
+        if self.timeout is not None:
+            return self.timeout
+        return getattr(settings, "PRODUCT_CACHE_TIMEOUT", 3600)
+
+    def version(self, pk):
+        version = self.cache.get("product:version:{pk}".format(pk=pk))
+        return 1 if version is None else version
+
+    def get_by_id(self, pk):
+        key = "product:{pk}:{version}".format(pk=pk, version=self.version(pk))
+        product = self.fetch(key, lambda: Product.objects.filter(pk=pk).first())
+        return None if product == MISSING else product
+
+    def get_by_slug(self, slug):
+        slug_key = "product:slug:{slug}".format(slug=slug)
+        pk = self.fetch(
+            slug_key,
+            lambda: Product.objects.filter(slug=slug).values_list("pk", flat=True).first(),
+        )
+        if pk == MISSING:
+            return None
+        product = self.get_by_id(pk)
+        if product is None or product.slug != slug:
+            # The slug moved to another product or was renamed since.
+            self.cache.delete(slug_key)
+            return Product.objects.filter(slug=slug).first()
+        return product
+
+    def invalidate(self, pk):
+        version_key = "product:version:{pk}".format(pk=pk)
+        if not self.cache.add(version_key, 2, None):
+            try:
+                self.cache.incr(version_key)
+            except ValueError:
+                self.cache.set(version_key, 2, None)
+
+    def invalidate_slug(self, slug):
+        # A slug entry pointing at another product is caught on read, but one
+        # may also hold a miss cached before the slug existed.
+        self.cache.delete("product:slug:{slug}".format(slug=slug))
+
+    def fetch(self, key, loader):
+        value = self.cache.get(key)
+        if value is not None:
+            self.count(hit=True)
+            return value
+        self.count(hit=False)
+        with self._locks[hash(key) % len(self._locks)]:
+            value = self.cache.get(key)
+            if value is not None:
+                return value
+            lock_key = key + ":lock"
+            if self.cache.add(lock_key, 1, LOCK_TIMEOUT):
+                try:
+                    value = self.store(key, loader())
+                finally:
+                    self.cache.delete(lock_key)
+                return value
+            # Another process is recomputing this key; wait for its result.
+            deadline = time.monotonic() + LOCK_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(0.01)
+                value = self.cache.get(key)
+                if value is not None:
+                    return value
+            return self.store(key, loader())
+
+    def store(self, key, value):
+        value = MISSING if value is None else value
+        self.cache.set(key, value, self.get_timeout())
+        return value
+
+    def count(self, hit):
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._counter_lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+product_cache = ProductCache()
+
+
+def invalidate_products(pks=(), slugs=(), using=None, on_version=None):
+    # Every product write ends up here: the model signals for single saves and
+    # deletes, ProductQuerySet for bulk writes, which send no signals. Cached
+    # products are dropped and the catalog version bumped once the transaction
+    # commits; doing it earlier would let a read in between cache the old rows
+    # again under the new version. `on_version(previous, version)` runs right
+    # after the bump.
+    pks, slugs = list(pks), [slug for slug in slugs if slug]
+
+    def invalidate():
+        for pk in pks:
+            product_cache.invalidate(pk)
+        for slug in slugs:
+            product_cache.invalidate_slug(slug)
+        previous = catalog_version()
+        version = bump_catalog_version()
+        if on_version is not None:
+            on_version(previous, version)
+
+    transaction.on_commit(invalidate, using=using)
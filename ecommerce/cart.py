@@ -0,0 +1,253 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+
+from .ids import next_order_id
+from .models import Product, OrderItem, Order, OrderLine, CENTS, MAX_LINE_QUANTITY
+
+
+COUPON_RATE = Decimal("0.1")
+
+Cart = namedtuple("Cart", ["items", "total_amount", "total_savings", "total_items"])
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    message = "There are no items in your cart"
+
+
+class OutOfStock(CheckoutError):
+    message = "Some items in your cart are out of stock"
+
+
+class CartError(Exception):
+    pass
+
+
+class InvalidQuantity(CartError):
+    message = "Quantity must be a positive number"
+
+
+class QuantityLimit(CartError):
+    message = "Maximum quantity is limited to {limit}".format(limit=MAX_LINE_QUANTITY)
+
+
+class NotEnoughStock(CartError):
+    message = "Not enough stock available"
+
+
+def add_to_cart(user, product, quantity):
+    # Race-free upsert of the user's open line for the product: a conditional
+    # UPDATE adds to an existing line only while it stays within the limits,
+    # otherwise the line is inserted; unique_cart_line turns a concurrent
+    # insert of the same line into an IntegrityError, after which the update
+    # is retried against the row that won.
+    if quantity < 1:
+        raise InvalidQuantity()
+    if quantity > product.available_quantity:
+        raise NotEnoughStock()
+    if quantity > MAX_LINE_QUANTITY:
+        raise QuantityLimit()
+    lines = OrderItem.objects.filter(user=user, product=product)
+
+    def increment():
+        return lines.filter(
+            quantity__lte=MAX_LINE_QUANTITY - quantity,
+            product__available_quantity__gte=F("quantity") + quantity,
+        ).update(quantity=F("quantity") + quantity)
+
+    if not increment():
+        try:
+            with transaction.atomic():
+                return OrderItem.objects.create(user=user, product=product, quantity=quantity)
+        except IntegrityError:
+            if not increment():
+                line = lines.first()
+                if line is None:
+                    # Removed again since the insert conflicted; start over.
+                    return add_to_cart(user, product, quantity)
+                if line.quantity + quantity > MAX_LINE_QUANTITY:
+                    raise QuantityLimit()
+                raise NotEnoughStock()
+    return lines.get()
+
+
+class UnknownProduct(CartError):
+    message = "Product does not exist"
+
+
+def apply_cart_operations(user, operations):
+    # A line inserted concurrently by add_to_cart makes the bulk insert fail on
+    # unique_cart_line; the second attempt sees and locks that line.
+    try:
+        return apply_operations(user, operations)
+    except IntegrityError:
+        return apply_operations(user, operations)
+
+
+@transaction.atomic
+def apply_operations(user, operations):
+    # Applies add/set/remove steps, in order, to the open cart with a fixed
+    # number of statements whatever the size of the batch: one read of the
+    # products, one of their open lines, then at most one bulk insert, one bulk
+    # update and one delete. Nothing is written if any step is invalid.
+    ids = {op["product_id"] for op in operations if "product_id" in op}
+    slugs = {op["slug"] for op in operations if "product_id" not in op}
+    products = list(
+        Product.objects.filter(Q(pk__in=ids) | Q(slug__in=slugs)).only(
+            "id", "slug", "available_quantity"
+        )
+    )
+    by_id = {product.pk: product for product in products}
+    by_slug = {product.slug: product for product in products}
+    lines = {
+        line.product_id: line
+        for line in OrderItem.objects.select_for_update().filter(
+            user=user, product__in=list(by_id)
+        )
+    }
+
+    quantities = {pk: line.quantity for pk, line in lines.items()}
+    for op in operations:
+        if "product_id" in op:
+            product = by_id.get(op["product_id"])
+        else:
+            product = by_slug.get(op["slug"])
+        if product is None:
+            raise UnknownProduct()
+        if op["op"] == "add":
+            quantities[product.pk] = quantities.get(product.pk, 0) + op["quantity"]
+        elif op["op"] == "set":
+            quantities[product.pk] = op["quantity"]
+        else:
+            quantities[product.pk] = 0
+
+    created, updated, removed = [], [], []
+    for pk, quantity in quantities.items():
+        line = lines.get(pk)
+        if line is not None and line.quantity == quantity:
+            continue
+        if quantity > MAX_LINE_QUANTITY:
+            raise QuantityLimit()
+        if quantity > by_id[pk].available_quantity:
+            raise NotEnoughStock()
+        if line is None:
+            if quantity:
+                created.append(OrderItem(user=user, product_id=pk, quantity=quantity))
+        elif quantity:
+            line.quantity = quantity
+            updated.append(line)
+        else:
+            removed.append(line.pk)
+
+    if removed:
+        OrderItem.objects.filter(pk__in=removed).delete()
+    if updated:
+        OrderItem.objects.bulk_update(updated, ["quantity"])
+    if created:
+        OrderItem.objects.bulk_create(created)
+
+
+def cart_data(request, cart):
+    return {
+        "cartItems": [cart_item_data(request, item) for item in cart.items],
+        "cartTotal": float(cart.total_amount),
+        "cartSavings": float(cart.total_savings),
+        "cartCount": cart.total_items,
+    }
+
+
+def load_cart(user):
+    # One joined query for the open cart lines and their products, plus one
+    # aggregate for the totals.
+    items = list(OrderItem.objects.cart(user))
+    totals = OrderItem.objects.cart_totals(user)
+    return Cart(items, totals.amount, totals.savings, totals.count)
+
+
+def cart_item_data(request, item):
+    product = item.product
+    return {
+        "id": item.id,
+        "product_id": product.id,
+        "product_name": product.product_name,
+        "slug": product.slug,
+        "price": product.price,
+        "discount": product.discount,
+        "quantity": item.quantity,
+        "image": "http://" + request.META["HTTP_HOST"] + "/media/" + str(product.image1),
+        "total_price": round(item.quantity * product.effective_price, 2),
+    }
+
+
+@transaction.atomic
+def checkout(user, address, coupon=None):
+    # Every statement below runs in one transaction and their number does not
+    # depend on the size of the cart, short of the backend splitting a large
+    # line insert into batches: read and lock the cart, aggregate the totals,
+    # decrement stock, create the order, copy the lines into its history and
+    # empty the cart. Time still grows with the rows copied.
+    cart = list(OrderItem.objects.cart(user).select_for_update(of=("self",)))
+    if not cart:
+        raise EmptyCart()
+    # Lines added while this checkout runs stay in the cart for next time.
+    cart_lines = OrderItem.objects.filter(pk__in=[item.pk for item in cart])
+    totals = cart_lines.totals()
+
+    # Decrement stock with one UPDATE driven by a correlated subquery over the
+    # cart; a negative quantity afterwards means the cart asked for more than
+    # was left and the whole transaction is rolled back.
+    demand = (
+        cart_lines.filter(product=OuterRef("pk"))
+        .values("product")
+        .annotate(total=Sum("quantity"))
+        .values("total")
+    )
+    products = Product.objects.filter(pk__in=cart_lines.values("product"))
+    products.update_products(
+        [item.product_id for item in cart],
+        available_quantity=F("available_quantity") - Subquery(demand),
+    )
+    if products.filter(available_quantity__lt=0).exists():
+        raise OutOfStock()
+
+    if coupon == "INSTANT10":
+        coupon_amount = (totals.amount * COUPON_RATE).quantize(CENTS)
+    else:
+        coupon_amount = Decimal(0)
+
+    order = Order.objects.create(
+        user=user,
+        order_id=next_order_id(),
+        total_amount=float(totals.amount + totals.savings),
+        total_items=totals.count,
+        coupon=coupon,
+        coupon_amount=float(coupon_amount),
+        order_amount=float(totals.amount - coupon_amount),
+        savings=float(coupon_amount + totals.savings),
+        address=address,
+    )
+    OrderLine.objects.bulk_create(order_line(order, item) for item in cart)
+    cart_lines.delete()
+    return order
+
+
+def order_line(order, item):
+    # The product as it was bought; order reads never go back to it.
+    product = item.product
+    return OrderLine(
+        order=order,
+        product=product,
+        quantity=item.quantity,
+        product_name=product.product_name,
+        product_slug=product.slug,
+        product_image=str(product.image1),
+        unit_price=product.price,
+        unit_discount=product.discount,
+        line_total=item.quantity * product.effective_price,
+    )
@@ -0,0 +1,126 @@
+from bisect import bisect_right
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, CharField, Count, F, Value, When
+
+from .models import CATEGORY_CHOICES, CatalogFacet, Product
+
+
+# Lower bounds of the effective price buckets shown in the catalog sidebar.
+PRICE_BUCKETS = (0, 1000, 5000, 10000, 25000, 50000)
+PRICE_LABELS = tuple(
+    "{low}-{high}".format(low=low, high=high)
+    for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:])
+) + ("{low}+".format(low=PRICE_BUCKETS[-1]),)
+
+
+def price_bucket(effective_price):
+    return PRICE_LABELS[max(bisect_right(PRICE_BUCKETS, effective_price) - 1, 0)]
+
+
+def price_bucket_expression():
+    whens = [
+        When(effective_price__gte=low, then=Value(label))
+        for low, label in reversed(list(zip(PRICE_BUCKETS[1:], PRICE_LABELS[1:])))
+    ]
+    return Case(*whens, default=Value(PRICE_LABELS[0]), output_field=CharField())
+
+
+def facet_values(product):
+    return (("category", product.category), ("price", price_bucket(product.effective_price)))
+
+
+def format_facets(counts):
+    # All known values in display order, zero counts included.
+    categories = [value for value, _ in CATEGORY_CHOICES]
+    categories += sorted(set(counts["category"]) - set(categories))
+    return {
+        "category": [
+            {"value": value, "count": counts["category"][value]} for value in categories
+        ],
+        "price": [{"value": value, "count": counts["price"][value]} for value in PRICE_LABELS],
+    }
+
+
+def grouped_counts(queryset):
+    # Category and price-bucket counts of any product queryset in one grouped
+    # query; each facet is summed up from the (category, bucket) groups.
+    rows = (
+        queryset.order_by()
+        .values("category", bucket=price_bucket_expression())
+        .annotate(total=Count("id"))
+    )
+    counts = {"category": Counter(), "price": Counter()}
+    for row in rows:
+        counts["category"][row["category"]] += row["total"]
+        counts["price"][row["bucket"]] += row["total"]
+    return counts
+
+
+def facet_counts(queryset):
+    return format_facets(grouped_counts(queryset))
+
+
+def catalog_facets(using=None):
+    counts = {"category": Counter(), "price": Counter()}
+    for facet, value, count in CatalogFacet.objects.using(using).values_list(
+        "facet", "value", "count"
+    ):
+        if count > 0:
+            counts[facet][value] = count
+    return format_facets(counts)
+
+
+def rebuild_facets(using=None):
+    counts = grouped_counts(Product.objects.using(using))
+    with transaction.atomic(using=using):
+        CatalogFacet.objects.using(using).all().delete()
+        CatalogFacet.objects.using(using).bulk_create(
+            CatalogFacet(facet=facet, value=value, count=count)
+            for facet, values in counts.items()
+            for value, count in values.items()
+        )
+
+
+def adjust(facet, value, delta, using=None):
+    facets = CatalogFacet.objects.using(using).filter(facet=facet, value=value)
+    if facets.update(count=F("count") + delta):
+        return
+    try:
+        with transaction.atomic(using=using):
+            CatalogFacet.objects.using(using).create(facet=facet, value=value, count=delta)
+    except IntegrityError:
+        # Created concurrently since the update above.
+        facets.update(count=F("count") + delta)
+
+
+def remember(instance, using=None):
+    # Called before a save to know which counts the save moves a product out of.
+    if instance.pk is None:
+        instance._facet_values = ()
+        return
+    previous = (
+        Product.objects.using(using)
+        .filter(pk=instance.pk)
+        .only("category", "effective_price")
+        .first()
+    )
+    instance._facet_values = facet_values(previous) if previous is not None else ()
+
+
+def product_saved(instance, using=None):
+    previous = getattr(instance, "_facet_values", ())
+    current = facet_values(instance)
+    for facet, value in previous:
+        if (facet, value) not in current:
+            adjust(facet, value, -1, using)
+    for facet, value in current:
+        if (facet, value) not in previous:
+            adjust(facet, value, 1, using)
+    instance._facet_values = current
+
+
+def product_deleted(instance, using=None):
+    for facet, value in facet_values(instance):
+        adjust(facet, value, -1, using)
@@ -0,0 +1,23 @@
+from django_filters import rest_framework as filters
+
+from .models import Product
+
+
+class ProductFilterSet(filters.FilterSet):
+    # Every filter here is served by an index on Product, see Product.Meta.
+    created_after = filters.IsoDateTimeFilter(field_name="created_at", lookup_expr="gte")
+    in_stock = filters.BooleanFilter(method="filter_in_stock")
+
+    class Meta:
+        model = Product
+        fields = {
+            "category": ["exact", "in"],
+            "price": ["gte", "lte"],
+            "effective_price": ["gte", "lte"],
+            "discount_pct": ["gte"],
+        }
+
+    def filter_in_stock(self, queryset, name, value):
+        if value:
+            return queryset.filter(available_quantity__gt=0)
+        return queryset.filter(available_quantity__lte=0)
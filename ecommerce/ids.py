@@ -0,0 +1,156 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+
+# Snowflake layout: 41 bits of milliseconds since EPOCH_MS, 10 bits of worker
+# id and 12 bits of per-millisecond sequence.
+EPOCH_MS = 1598832000000  # 2020-08-31 00:00:00 UTC
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+
+ORDER_ID_PREFIX = "ODR"
+ORDER_ID_DIGITS = 19
+
+
+class SnowflakeGenerator:
+    def __init__(self, worker_id, epoch_ms=EPOCH_MS, clock=time.time):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(
+                "worker_id must be between 0 and {max}".format(max=MAX_WORKER_ID)
+            )
+        self.worker_id = worker_id
+        self.epoch_ms = epoch_ms
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            now = int(self.clock() * 1000)
+            if now <= self._last_ms:
+                # Same millisecond, or the clock stepped backwards: keep counting
+                # from the last timestamp and borrow the next millisecond when
+                # the sequence runs out, so ids never repeat or go backwards.
+                now = self._last_ms
+                self._sequence = (self._sequence + 1) & SEQUENCE_MASK
+                if self._sequence == 0:
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (
+                ((now - self.epoch_ms) << (WORKER_BITS + SEQUENCE_BITS))
+                | (self.worker_id << SEQUENCE_BITS)
+                | self._sequence
+            )
+
+
+class NoWorkerId(Exception):
+    pass
+
+
+class WorkerLease:
+    """A worker id leased from the OrderIdWorker table.
+
+    A process claims the row renewed longest ago, provided its lease has
+    expired, and renews it once half the lease has passed. Claims and
+    renewals made inside a transaction only count once it commits: until
+    then every call renews again, so an order id can only be committed along
+    with the lease it was generated under.
+    """
+
+    def __init__(self, holder=None, lease_seconds=None, clock=timezone.now):
+        if holder is None:
+            holder = "{host}:{pid}:{token}".format(
+                host=socket.gethostname()[:40], pid=os.getpid(), token=uuid.uuid4().hex
+            )
+        if lease_seconds is None:
+            lease_seconds = settings.ORDER_ID_WORKER_LEASE
+        self.holder = holder
+        self.lease = timedelta(seconds=lease_seconds)
+        self.clock = clock
+        # Reentrant: outside a transaction on_commit confirms right away.
+        self._lock = threading.RLock()
+        self._worker_id = None
+        self._renewed_at = None
+        self._pending = False
+
+    def worker_id(self):
+        from .models import OrderIdWorker
+
+        with self._lock:
+            now = self.clock()
+            if self._worker_id is not None and not self._pending:
+                if now - self._renewed_at < self.lease / 2:
+                    return self._worker_id
+            renewed = self._worker_id is not None and OrderIdWorker.objects.filter(
+                worker_id=self._worker_id, holder=self.holder
+            ).update(renewed_at=now)
+            if not renewed:
+                self._worker_id = self._claim(OrderIdWorker, now)
+            self._pending = True
+            transaction.on_commit(lambda: self._confirm(now))
+            return self._worker_id
+
+    def _claim(self, OrderIdWorker, now):
+        expired = Q(renewed_at=None) | Q(renewed_at__lt=now - self.lease)
+        created = False
+        for _ in range(10):
+            free = (
+                OrderIdWorker.objects.filter(expired)
+                .order_by("renewed_at", "worker_id")
+                .values("worker_id", "holder", "renewed_at")
+                .first()
+            )
+            if free is None:
+                if created:
+                    break
+                # The rows are created on first use.
+                OrderIdWorker.objects.bulk_create(
+                    (OrderIdWorker(worker_id=i) for i in range(MAX_WORKER_ID + 1)),
+                    ignore_conflicts=True,
+                )
+                created = True
+                continue
+            # Only one of several processes racing for the row gets it.
+            if OrderIdWorker.objects.filter(**free).update(holder=self.holder, renewed_at=now):
+                return free["worker_id"]
+        raise NoWorkerId("No order id worker id is free to lease")
+
+    def _confirm(self, renewed_at):
+        with self._lock:
+            self._pending = False
+            self._renewed_at = renewed_at
+
+
+_generator = None
+_lease = None
+_lease_pid = None
+
+
+def next_order_id():
+    # The lease is per process (also after a fork); the generator is replaced
+    # whenever the lease was lost and another worker id had to be claimed.
+    global _generator, _lease, _lease_pid
+    worker_id = getattr(settings, "ORDER_ID_WORKER_ID", None)
+    if worker_id is None:
+        if _lease is None or _lease_pid != os.getpid():
+            _lease = WorkerLease()
+            _lease_pid = os.getpid()
+        worker_id = _lease.worker_id()
+    if _generator is None or _generator.worker_id != worker_id:
+        _generator = SnowflakeGenerator(worker_id)
+    # Zero padding keeps the string form sortable in creation order.
+    return ORDER_ID_PREFIX + str(_generator.next_id()).zfill(ORDER_ID_DIGITS)
@@ -0,0 +1,336 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from knox.auth import TokenAuthentication
+from knox.models import AuthToken
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from accounts.auth import CachedTokenAuthentication, token_cache
+from ecommerce.cart import checkout, order_line
+from ecommerce.ids import next_order_id
+from ecommerce.models import Product, OrderItem, Address, Order
+from ecommerce.serializers import (
+    ProductSerializer,
+    ProductListSerializer,
+    ValuesSerializer,
+)
+from ecommerce.search import (
+    SEARCH_COLUMNS,
+    SEARCH_RANK_LIMIT,
+    rebuild_search_index,
+    search_products,
+)
+from ecommerce.suggest import PrefixIndex
+
+
+def timed(func, repeat, setup=None):
+    # Best of `repeat` runs, in milliseconds.
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def make_products(count, prefix="Bench product"):
+    Product.objects.bulk_create(
+        (
+            Product(
+                product_name="%s %d" % (prefix, i),
+                slug="%s-%d" % (prefix.lower().replace(" ", "-"), i),
+                short_desc="Short description %d" % i,
+                description="Long description of product %d. " % i * 10,
+                category="Mobile Phones",
+                price=100.0 + i,
+                discount=float(i % 10),
+                available_quantity=1000000,
+                tags="bench,product",
+            )
+            for i in range(count)
+        ),
+        batch_size=1000,
+    )
+    # SQLite does not return primary keys from bulk_create.
+    return list(Product.objects.filter(product_name__startswith=prefix).order_by("id"))
+
+
+def make_client():
+    user = User.objects.create_user("bench-%d" % User.objects.count())
+    client = APIClient(HTTP_HOST="testserver")
+    client.force_authenticate(user)
+    return user, client
+
+
+@transaction.atomic
+def per_line_checkout(user, address):
+    # Checkout as it was before the single pipeline: a read, a stock update,
+    # a line insert and a cart delete per cart line. Kept for comparison.
+    amount = savings = count = 0
+    order = Order.objects.create(
+        user=user, order_id=next_order_id(), total_items=0, address=address
+    )
+    for item in OrderItem.objects.filter(user=user):
+        product = item.product
+        amount += item.quantity * product.effective_price
+        savings += item.quantity * product.discount
+        count += item.quantity
+        Product.objects.filter(pk=product.pk).update_products(
+            [product.pk], available_quantity=F("available_quantity") - item.quantity
+        )
+        order_line(order, item).save()
+        item.delete()
+    order.total_amount = amount + savings
+    order.order_amount = amount
+    order.savings = savings
+    order.total_items = count
+    order.save()
+    return order
+
+
+def bench_checkout(command, options):
+    sizes = (1, 10, 50, 100, 250)
+    products = make_products(max(sizes))
+    # Lease the order id worker id up front rather than in the first checkout.
+    next_order_id()
+    command.stdout.write(
+        "%10s %12s %8s %12s %8s"
+        % ("cart lines", "pipeline ms", "queries", "per-line ms", "queries")
+    )
+    for size in sizes:
+        user, _ = make_client()
+        address = Address.objects.create(
+            user=user,
+            first_name="Bench",
+            last_name="User",
+            line1="Line 1",
+            landmark="Landmark",
+            zip_code=795001,
+            state="Manipur",
+            country="India",
+            mobile="9999999999",
+        )
+
+        def fill_cart():
+            OrderItem.objects.bulk_create(
+                OrderItem(user=user, product=product, quantity=1)
+                for product in products[:size]
+            )
+
+        row = [size]
+        for run in (lambda: checkout(user, address), lambda: per_line_checkout(user, address)):
+            fill_cart()
+            with CaptureQueriesContext(connection) as queries:
+                run()
+            row += [timed(run, options["repeat"], fill_cart), len(queries)]
+        command.stdout.write("%10d %12.2f %8d %12.2f %8d" % tuple(row))
+
+
+SEARCH_WORDS = (
+    "apple samsung oneplus oppo galaxy iphone pixel surface ipad note reno "
+    "wireless bluetooth noise cancelling camera lens mirrorless tablet laptop "
+    "phone earbuds headphones charger fast amoled retina pro max mini air lite"
+).split()
+
+
+def make_catalog(count):
+    words = SEARCH_WORDS
+    Product.objects.bulk_create(
+        (
+            Product(
+                product_name="%s %s %s %d"
+                % (words[i % 7], words[i % 11 + 3], words[i % 13 + 14], i),
+                slug="search-%d" % i,
+                short_desc="%s %s" % (words[i % 17], words[i % 19 + 2]),
+                description=" ".join(words[(i + j) % len(words)] for j in range(40)),
+                category="Mobile Phones",
+                price=100.0 + i % 1000,
+                discount=0,
+                available_quantity=10,
+                tags="%s,%s" % (words[i % 5], words[i % 23]),
+            )
+            for i in range(count)
+        ),
+        batch_size=2000,
+    )
+
+
+def bench_search(command, options):
+    count = options["products"]
+    make_catalog(count)
+    products = Product.objects.all()
+
+    def like(term):
+        # What SearchFilter compiles to for the same columns: LIKE '%word%'.
+        queryset = products
+        for word in term.split():
+            matches = Q()
+            for column in SEARCH_COLUMNS:
+                matches |= Q(**{column + "__icontains": word})
+            queryset = queryset.filter(matches)
+        return queryset.order_by("id")
+
+    def fts(term):
+        return search_products(products, term).order_by("id")
+
+    def fts_ranked(term):
+        return search_products(products, term).order_by("search_rank", "id")
+
+    def default_page(term):
+        # ProductSearchFilter without ?ordering, counting uncached: ranked up
+        # to SEARCH_RANK_LIMIT matches, otherwise unranked in id order.
+        results = search_products(products, term)
+        if results.count() <= SEARCH_RANK_LIMIT:
+            return list(results.order_by("search_rank", "id")[:20])
+        return list(results.order_by("id")[:20])
+
+    command.stdout.write("%d products, times in ms" % count)
+    command.stdout.write(
+        "%-16s %10s %10s %10s %10s %12s %12s"
+        % ("term", "like page", "fts page", "ranked", "default", "like count", "fts count")
+    )
+    for term in ("iphone", "samsung galaxy", "pixel 4242", "xyz"):
+        row = []
+        for search in (like, fts, fts_ranked):
+            row.append(timed(lambda: list(search(term)[:20]), options["repeat"]))
+        row.append(timed(lambda: default_page(term), options["repeat"]))
+        for search in (like, fts):
+            row.append(timed(lambda: search(term).count(), options["repeat"]))
+        command.stdout.write(
+            "%-16s %10.2f %10.2f %10.2f %10.2f %12.2f %12.2f" % tuple([term] + row)
+        )
+
+
+def bench_suggest(command, options):
+    count = options["products"]
+    make_catalog(count)
+    index = PrefixIndex()
+    rows = Product.objects.values_list("id", "slug", "product_name", "image1", "tags")
+    start = time.perf_counter()
+    index.load(rows.iterator(), version=0)
+    command.stdout.write(
+        "built index over %d products in %.0f ms"
+        % (count, (time.perf_counter() - start) * 1000)
+    )
+    lookups = 10000
+    command.stdout.write("%-12s %14s" % ("prefix", "us per lookup"))
+    for prefix in ("i", "iph", "samsung gal", "pixel 424", "xyz"):
+        elapsed = timed(
+            lambda: [index.lookup(prefix, 8) for _ in range(lookups)], options["repeat"]
+        )
+        command.stdout.write("%-12s %14.2f" % (prefix, elapsed * 1000 / lookups))
+
+
+def bench_serialize(command, options):
+    make_catalog(1000)
+    request = Request(
+        APIRequestFactory().get("/api/products-filter/", HTTP_HOST="testserver")
+    )
+    context = {"request": request}
+    renderer = JSONRenderer()
+    queryset = Product.objects.order_by("id")
+    command.stdout.write(
+        "%-22s %-6s %6s %10s %14s" % ("serializer", "path", "rows", "bytes", "ms per 1000")
+    )
+    for rows in (20, 1000):
+        for serializer_class in (ProductSerializer, ProductListSerializer):
+            fast = ValuesSerializer(serializer_class)
+
+            def model():
+                products = list(queryset[:rows])
+                data = serializer_class(products, many=True, context=context).data
+                return renderer.render(data)
+
+            def values():
+                products = list(queryset.values(*fast.columns)[:rows])
+                return renderer.render(fast.serialize(products, request))
+
+            for path, render in (("model", model), ("values", values)):
+                elapsed = timed(render, options["repeat"])
+                command.stdout.write(
+                    "%-22s %-6s %6d %10d %14.2f"
+                    % (serializer_class.__name__, path, rows, len(render()), elapsed * 1000 / rows)
+                )
+
+
+def bench_auth(command, options):
+    user = User.objects.create_user("bench-auth")
+    _, token = AuthToken.objects.create(user)
+    request = APIRequestFactory().get(
+        "/api/auth/user", HTTP_AUTHORIZATION="Token " + token, HTTP_HOST="testserver"
+    )
+    requests = 1000
+    command.stdout.write("%-26s %14s %8s" % ("authentication", "us per request", "queries"))
+    for authentication in (TokenAuthentication(), CachedTokenAuthentication()):
+        token_cache.clear()
+        # The first request fills the cache; count what a repeat request costs.
+        authentication.authenticate(request)
+        with CaptureQueriesContext(connection) as queries:
+            authentication.authenticate(request)
+        elapsed = timed(
+            lambda: [authentication.authenticate(request) for _ in range(requests)],
+            options["repeat"],
+        )
+        command.stdout.write(
+            "%-26s %14.2f %8d"
+            % (type(authentication).__name__, elapsed * 1000 / requests, len(queries))
+        )
+
+
+SCENARIOS = {
+    "auth": bench_auth,
+    "checkout": bench_checkout,
+    "search": bench_search,
+    "serialize": bench_serialize,
+    "suggest": bench_suggest,
+}
+
+
+class Command(BaseCommand):
+    help = "Run performance benchmarks against a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "scenarios", nargs="*", help="One or more of: %s." % ", ".join(sorted(SCENARIOS))
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--products", type=int, default=100000)
+
+    def handle(self, *args, **options):
+        scenarios = options["scenarios"] or sorted(SCENARIOS)
+        unknown = [name for name in scenarios if name not in SCENARIOS]
+        if unknown:
+            raise CommandError("Unknown scenario: %s." % ", ".join(unknown))
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            for index, name in enumerate(scenarios):
+                if index:
+                    # Every scenario starts from an empty database. The FTS
+                    # table is not a model, so flush leaves it alone.
+                    call_command("flush", interactive=False, verbosity=0)
+                    rebuild_search_index()
+                    cache.clear()
+                # The log is capped; once full, captured query counts read 0.
+                connection.queries_log.clear()
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                SCENARIOS[name](self, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
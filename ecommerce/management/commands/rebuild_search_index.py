@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from ecommerce.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full-text index, e.g. after loading a fixture."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        rebuild_search_index(options["database"])
@@ -0,0 +1,67 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+def reassign_duplicate_order_ids(apps, schema_editor):
+    # The old random six-digit ids collide; every order after the first with
+    # a given id gets that id plus a suffix so the unique index below can be
+    # created. Ordered lines carry the id as text, so each one follows the
+    # earliest order of its user placed after it was added to the cart.
+    Order = apps.get_model('ecommerce', 'Order')
+    OrderItem = apps.get_model('ecommerce', 'OrderItem')
+
+    duplicates = (
+        Order.objects.values('order_id')
+        .annotate(count=models.Count('id'))
+        .filter(count__gt=1)
+        .values_list('order_id', flat=True)
+    )
+    taken = set(Order.objects.values_list('order_id', flat=True))
+    for order_id in list(duplicates):
+        orders = list(Order.objects.filter(order_id=order_id).order_by('created_at', 'id'))
+        items = list(OrderItem.objects.filter(order_id=order_id, is_ordered=True))
+        for order in orders[1:]:
+            suffix = 2
+            while '{}-{}'.format(order_id, suffix) in taken:
+                suffix += 1
+            order.order_id = '{}-{}'.format(order_id, suffix)
+            taken.add(order.order_id)
+            order.save(update_fields=['order_id'])
+        for item in items:
+            candidates = [order for order in orders if order.user_id == item.user_id]
+            if not candidates:
+                continue
+            owner = next(
+                (order for order in candidates if order.created_at >= item.created_at),
+                candidates[-1],
+            )
+            if owner.order_id != item.order_id:
+                item.order_id = owner.order_id
+                item.save(update_fields=['order_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0012_wishlist'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='order_id',
+            field=models.CharField(max_length=24),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='order_id',
+            field=models.CharField(blank=True, db_index=True, max_length=24, null=True),
+        ),
+        migrations.RunPython(reassign_duplicate_order_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='order_id',
+            field=models.CharField(max_length=24, unique=True),
+        ),
+    ]
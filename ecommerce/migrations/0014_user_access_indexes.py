@@ -0,0 +1,56 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+def merge_duplicate_rows(apps, schema_editor):
+    # Collapse duplicate open cart lines and wishlist entries so that the
+    # unique constraints below can be created.
+    OrderItem = apps.get_model('ecommerce', 'OrderItem')
+    Wishlist = apps.get_model('ecommerce', 'Wishlist')
+
+    seen = {}
+    for item in OrderItem.objects.filter(is_ordered=False).order_by('id'):
+        key = (item.user_id, item.product_id)
+        if key in seen:
+            kept = seen[key]
+            kept.quantity = min(kept.quantity + item.quantity, 5)
+            kept.save(update_fields=['quantity'])
+            item.delete()
+        else:
+            seen[key] = item
+
+    seen = set()
+    for entry in Wishlist.objects.order_by('id'):
+        key = (entry.user_id, entry.product_id)
+        if key in seen:
+            entry.delete()
+        else:
+            seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0013_order_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['user', 'is_ordered'], name='orderitem_user_ordered_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(condition=models.Q(is_ordered=False), fields=('user', 'product'), name='unique_open_cart_line'),
+        ),
+        migrations.AddConstraint(
+            model_name='wishlist',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_wishlist_product'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations
+
+
+# Frozen copies of ecommerce.search's layout as of this migration.
+SEARCH_COLUMNS = ('product_name', 'short_desc', 'description', 'tags')
+FTS_TABLE = 'ecommerce_product_fts'
+PG_SEARCH_INDEX = 'product_search_idx'
+PG_DOCUMENT = "to_tsvector('english', {columns})".format(
+    columns=" || ' ' || ".join(
+        "coalesce(\"ecommerce_product\".\"{column}\", '')".format(column=column)
+        for column in SEARCH_COLUMNS
+    )
+)
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5({columns})'.format(
+                    table=FTS_TABLE, columns=', '.join(SEARCH_COLUMNS)
+                )
+            )
+            cursor.execute(
+                'INSERT INTO {table} (rowid, {columns}) '
+                'SELECT id, {values} FROM ecommerce_product'.format(
+                    table=FTS_TABLE,
+                    columns=', '.join(SEARCH_COLUMNS),
+                    values=', '.join("coalesce({0}, '')".format(c) for c in SEARCH_COLUMNS),
+                )
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS {index} ON ecommerce_product '
+                'USING GIN ({document})'.format(index=PG_SEARCH_INDEX, document=PG_DOCUMENT)
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('DROP TABLE IF EXISTS {table}'.format(table=FTS_TABLE))
+        elif connection.vendor == 'postgresql':
+            cursor.execute('DROP INDEX IF EXISTS {index}'.format(index=PG_SEARCH_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0015_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
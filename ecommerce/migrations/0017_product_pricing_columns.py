@@ -0,0 +1,47 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:19
+
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, FloatField, Value
+from django.db.models.functions import Coalesce, NullIf
+
+
+def backfill_pricing(apps, schema_editor):
+    # Same formulas as Product.sync_pricing(); 0 for free products.
+    Product = apps.get_model('ecommerce', 'Product')
+    percentage = F('discount') * 100.0 / NullIf(F('price'), Value(0))
+    Product.objects.update(
+        effective_price=ExpressionWrapper(F('price') - F('discount'), output_field=FloatField()),
+        discount_pct=Coalesce(
+            ExpressionWrapper(percentage, output_field=FloatField()), Value(0.0),
+            output_field=FloatField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0016_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='discount_pct',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_pricing, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='product_effective_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['discount_pct', 'id'], name='product_discount_pct_id_idx'),
+        ),
+    ]
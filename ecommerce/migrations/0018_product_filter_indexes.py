@@ -0,0 +1,21 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0017_product_pricing_columns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'id'], name='product_category_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(available_quantity__gt=0), fields=['id'], name='product_in_stock_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:22
+
+from django.db import migrations, models
+from django.db.models import Case, CharField, Count, Value, When
+
+
+# ecommerce.facets.PRICE_BUCKETS as of this migration.
+PRICE_BUCKETS = (0, 1000, 5000, 10000, 25000, 50000)
+PRICE_LABELS = tuple(
+    '{low}-{high}'.format(low=low, high=high)
+    for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:])
+) + ('{low}+'.format(low=PRICE_BUCKETS[-1]),)
+
+
+def count_facets(apps, schema_editor):
+    Product = apps.get_model('ecommerce', 'Product')
+    CatalogFacet = apps.get_model('ecommerce', 'CatalogFacet')
+    using = schema_editor.connection.alias
+
+    bucket = Case(
+        *[
+            When(effective_price__gte=low, then=Value(label))
+            for low, label in reversed(list(zip(PRICE_BUCKETS[1:], PRICE_LABELS[1:])))
+        ],
+        default=Value(PRICE_LABELS[0]),
+        output_field=CharField(),
+    )
+    counts = {}
+    rows = (
+        Product.objects.using(using).order_by()
+        .values('category', bucket=bucket)
+        .annotate(total=Count('id'))
+    )
+    for row in rows:
+        for key in (('category', row['category']), ('price', row['bucket'])):
+            counts[key] = counts.get(key, 0) + row['total']
+    CatalogFacet.objects.using(using).bulk_create(
+        CatalogFacet(facet=facet, value=value, count=count)
+        for (facet, value), count in counts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0018_product_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogFacet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='catalogfacet',
+            constraint=models.UniqueConstraint(fields=('facet', 'value'), name='unique_catalog_facet'),
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
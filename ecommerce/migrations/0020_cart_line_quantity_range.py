@@ -0,0 +1,32 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:24
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def clamp_open_cart_lines(apps, schema_editor):
+    # Open lines that the old read-modify-write let past the limit.
+    OrderItem = apps.get_model('ecommerce', 'OrderItem')
+    open_lines = OrderItem.objects.filter(is_ordered=False)
+    open_lines.filter(quantity__lt=1).delete()
+    open_lines.filter(quantity__gt=5).update(quantity=5)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0019_catalog_facets'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderitem',
+            name='quantity',
+            field=models.IntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.RunPython(clamp_open_cart_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.CheckConstraint(check=models.Q(('is_ordered', True), models.Q(('quantity__gte', 1), ('quantity__lte', 5)), _connector='OR'), name='open_cart_line_quantity_range'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def clear_unknown_order_ids(apps, schema_editor):
+    # Lines tagged with an order number that has no Order would violate the
+    # new foreign key.
+    OrderItem = apps.get_model('ecommerce', 'OrderItem')
+    Order = apps.get_model('ecommerce', 'Order')
+    OrderItem.objects.filter(order_id__isnull=False).exclude(
+        order_id__in=Order.objects.values('order_id')
+    ).update(order_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0020_cart_line_quantity_range'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_user_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_id_idx'),
+        ),
+        migrations.RunPython(clear_unknown_order_ids, migrations.RunPython.noop),
+        # The order_id column keeps its data; it becomes the column of the
+        # new `order` foreign key to Order.order_id.
+        migrations.RenameField(
+            model_name='orderitem',
+            old_name='order_id',
+            new_name='order',
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(blank=True, db_column='order_id', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='ecommerce.order', to_field='order_id'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:28
+
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, FloatField, OuterRef, Subquery
+
+
+def snapshot_ordered_lines(apps, schema_editor):
+    # Lines ordered before snapshots existed get today's product details,
+    # the closest record there is.
+    OrderItem = apps.get_model('ecommerce', 'OrderItem')
+    Product = apps.get_model('ecommerce', 'Product')
+
+    def product_value(field):
+        return Subquery(Product.objects.filter(pk=OuterRef('product_id')).values(field)[:1])
+
+    OrderItem.objects.filter(is_ordered=True).update(
+        product_name=product_value('product_name'),
+        product_slug=product_value('slug'),
+        product_image=product_value('image1'),
+        unit_price=product_value('price'),
+        unit_discount=product_value('discount'),
+        line_total=ExpressionWrapper(
+            F('quantity') * product_value('effective_price'), output_field=FloatField()
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0021_order_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='line_total',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_image',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_slug',
+            field=models.SlugField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_discount',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(snapshot_ordered_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,176 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BATCH_SIZE = 1000
+# The quantity range of a cart line, as of 0020.
+MIN_QUANTITY = 1
+MAX_QUANTITY = 5
+
+
+def move_ordered_lines(apps, schema_editor):
+    # Ordered rows leave the cart table for the order line history.
+    OrderItem = apps.get_model('ecommerce', 'OrderItem')
+    OrderLine = apps.get_model('ecommerce', 'OrderLine')
+    Order = apps.get_model('ecommerce', 'Order')
+
+    orders = dict(Order.objects.values_list('order_id', 'id'))
+    ordered = OrderItem.objects.filter(is_ordered=True)
+    lines = []
+    for item in ordered.exclude(order_id=None).order_by('id').iterator():
+        lines.append(OrderLine(
+            order_id=orders[item.order_id],
+            product_id=item.product_id,
+            quantity=item.quantity,
+            product_name=item.product_name or '',
+            product_slug=item.product_slug,
+            product_image=item.product_image or '',
+            unit_price=item.unit_price or 0,
+            unit_discount=item.unit_discount or 0,
+            line_total=item.line_total or 0,
+        ))
+        if len(lines) == BATCH_SIZE:
+            OrderLine.objects.bulk_create(lines)
+            lines = []
+    OrderLine.objects.bulk_create(lines)
+    ordered.exclude(order_id=None).delete()
+    return_orphans_to_carts(OrderItem)
+
+
+def return_orphans_to_carts(OrderItem):
+    # Ordered rows whose order no longer exists (cleared in 0021) have no
+    # order to go with, so they go back into their user's cart instead of
+    # being lost: merged with any open line for the same product and clamped
+    # to the quantity range of a cart line.
+    open_lines = {
+        (item.user_id, item.product_id): item
+        for item in OrderItem.objects.filter(is_ordered=False)
+    }
+    reopened = {}
+    merged = {}
+    duplicates = []
+    for item in OrderItem.objects.filter(is_ordered=True).order_by('id'):
+        line = open_lines.get((item.user_id, item.product_id))
+        if line is None:
+            item.is_ordered = False
+            item.quantity = max(MIN_QUANTITY, min(item.quantity, MAX_QUANTITY))
+            open_lines[item.user_id, item.product_id] = reopened[item.pk] = item
+        else:
+            line.quantity = max(MIN_QUANTITY, min(line.quantity + item.quantity, MAX_QUANTITY))
+            if line.pk not in reopened:
+                merged[line.pk] = line
+            duplicates.append(item.pk)
+    for start in range(0, len(duplicates), BATCH_SIZE):
+        OrderItem.objects.filter(pk__in=duplicates[start:start + BATCH_SIZE]).delete()
+    OrderItem.objects.bulk_update(
+        reopened.values(), ['is_ordered', 'quantity'], batch_size=BATCH_SIZE
+    )
+    OrderItem.objects.bulk_update(merged.values(), ['quantity'], batch_size=BATCH_SIZE)
+
+
+def restore_ordered_lines(apps, schema_editor):
+    OrderItem = apps.get_model('ecommerce', 'OrderItem')
+    OrderLine = apps.get_model('ecommerce', 'OrderLine')
+
+    # Cart rows need a product, so lines whose product has since been deleted
+    # cannot be restored and are left out.
+    items = []
+    lines = OrderLine.objects.exclude(product=None).select_related('order').order_by('id')
+    for line in lines.iterator():
+        items.append(OrderItem(
+            user_id=line.order.user_id,
+            order_id=line.order.order_id,
+            product_id=line.product_id,
+            quantity=line.quantity,
+            is_ordered=True,
+            product_name=line.product_name,
+            product_slug=line.product_slug,
+            product_image=line.product_image,
+            unit_price=line.unit_price,
+            unit_discount=line.unit_discount,
+            line_total=line.line_total,
+        ))
+        if len(items) == BATCH_SIZE:
+            OrderItem.objects.bulk_create(items)
+            items = []
+    OrderItem.objects.bulk_create(items)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0022_order_line_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('product_name', models.CharField(max_length=255)),
+                ('product_slug', models.SlugField(blank=True, max_length=255, null=True)),
+                ('product_image', models.CharField(blank=True, max_length=100)),
+                ('unit_price', models.FloatField()),
+                ('unit_discount', models.FloatField()),
+                ('line_total', models.FloatField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='ecommerce.order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='ecommerce.product')),
+            ],
+        ),
+        migrations.RunPython(move_ordered_lines, restore_ordered_lines),
+        migrations.RemoveConstraint(
+            model_name='orderitem',
+            name='unique_open_cart_line',
+        ),
+        migrations.RemoveConstraint(
+            model_name='orderitem',
+            name='open_cart_line_quantity_range',
+        ),
+        migrations.RemoveIndex(
+            model_name='orderitem',
+            name='orderitem_user_ordered_idx',
+        ),
+        migrations.RemoveField(
+            model_name='orderitem',
+            name='is_ordered',
+        ),
+        migrations.RemoveField(
+            model_name='orderitem',
+            name='line_total',
+        ),
+        migrations.RemoveField(
+            model_name='orderitem',
+            name='order',
+        ),
+        migrations.RemoveField(
+            model_name='orderitem',
+            name='product_image',
+        ),
+        migrations.RemoveField(
+            model_name='orderitem',
+            name='product_name',
+        ),
+        migrations.RemoveField(
+            model_name='orderitem',
+            name='product_slug',
+        ),
+        migrations.RemoveField(
+            model_name='orderitem',
+            name='unit_discount',
+        ),
+        migrations.RemoveField(
+            model_name='orderitem',
+            name='unit_price',
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_cart_line'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.CheckConstraint(check=models.Q(('quantity__gte', 1), ('quantity__lte', 5)), name='cart_line_quantity_range'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.14 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0023_split_cart_and_order_lines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderIdWorker',
+            fields=[
+                ('worker_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('holder', models.CharField(blank=True, max_length=100)),
+                ('renewed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -1,4 +1,9 @@
+from collections import namedtuple
+from decimal import Decimal
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import DecimalField, ExpressionWrapper, F, FloatField, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.utils.text import slugify
 import random
 from django.contrib.auth.models import User
@@ -13,6 +18,114 @@ CATEGORY_CHOICES = (
 )
 
 
+PRICING_FIELDS = ("price", "discount")
+DERIVED_PRICING_FIELDS = ("effective_price", "discount_pct")
+# Product fields the catalog facets are derived from, see ecommerce.facets.
+FACET_FIELDS = ("category",) + PRICING_FIELDS
+# Columns of the full-text index, see ecommerce.search.
+SEARCH_FIELDS = ("product_name", "short_desc", "description", "tags")
+
+
+def as_expression(value):
+    return value if hasattr(value, "resolve_expression") else Value(value)
+
+
+def effective_price_expression(price, discount):
+    return ExpressionWrapper(
+        as_expression(price) - as_expression(discount), output_field=FloatField()
+    )
+
+
+def discount_pct_expression(price, discount):
+    # 0 for free products instead of a division by zero.
+    percentage = as_expression(discount) * 100.0 / NullIf(as_expression(price), Value(0))
+    return Coalesce(
+        ExpressionWrapper(percentage, output_field=FloatField()), Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+class ProductQuerySet(models.QuerySet):
+    # effective_price and discount_pct are derived from price and discount;
+    # every write path that can change those keeps them in sync. None of these
+    # send model signals, so they refresh the search index and invalidate the
+    # product caches themselves.
+    def update(self, **kwargs):
+        return self.update_products(self.values_list("pk", flat=True), **kwargs)
+
+    update.alters_data = True
+
+    def update_products(self, pks, **kwargs):
+        # update() for callers that already know the ids of the matching
+        # products, saving the read of them.
+        pks = list(pks)
+        if any(field in kwargs for field in PRICING_FIELDS):
+            price = kwargs.get("price", F("price"))
+            discount = kwargs.get("discount", F("discount"))
+            kwargs["effective_price"] = effective_price_expression(price, discount)
+            kwargs["discount_pct"] = discount_pct_expression(price, discount)
+        rows = super().update(**kwargs)
+        if any(field in kwargs for field in FACET_FIELDS):
+            self.rebuild_facets()
+        if any(field in kwargs for field in SEARCH_FIELDS):
+            self.reindex_products(pks)
+        slug = kwargs.get("slug")
+        self.invalidate_products(pks, [slug] if isinstance(slug, str) else [])
+        return rows
+
+    update_products.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.sync_pricing()
+        objs = super().bulk_create(objs, *args, **kwargs)
+        self.rebuild_facets()
+        pks = [obj.pk for obj in objs]
+        # Backends that do not return the new ids get the whole index rebuilt.
+        self.reindex_products(None if None in pks else pks)
+        self.invalidate_products(
+            [obj.pk for obj in objs if obj.pk is not None], [obj.slug for obj in objs]
+        )
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        fields = list(fields)
+        if any(field in fields for field in PRICING_FIELDS):
+            objs = list(objs)
+            for obj in objs:
+                obj.sync_pricing()
+            fields += [field for field in DERIVED_PRICING_FIELDS if field not in fields]
+        objs = list(objs)
+        super().bulk_update(objs, fields, *args, **kwargs)
+        if any(field in fields for field in FACET_FIELDS):
+            self.rebuild_facets()
+        if any(field in fields for field in SEARCH_FIELDS):
+            self.reindex_products([obj.pk for obj in objs])
+        self.invalidate_products(
+            [obj.pk for obj in objs], [obj.slug for obj in objs] if "slug" in fields else []
+        )
+
+    bulk_update.alters_data = True
+
+    def rebuild_facets(self):
+        # Bulk writes skip the per-product signals that keep the facet table
+        # current, so it is recounted instead.
+        from .facets import rebuild_facets
+
+        rebuild_facets(self.db)
+
+    def reindex_products(self, pks):
+        from .search import reindex_products
+
+        reindex_products(pks, self.db)
+
+    def invalidate_products(self, pks, slugs):
+        from .cache import invalidate_products
+
+        invalidate_products(pks, slugs, self.db)
+
+
 class Product(models.Model):
     product_name = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, null=True, blank=True)
@@ -28,6 +141,27 @@ class Product(models.Model):
     image4 = models.ImageField(null=True, blank=True, upload_to="product_images")
     tags = models.CharField(max_length=255, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized from price and discount, see sync_pricing().
+    effective_price = models.FloatField(default=0, editable=False)
+    discount_pct = models.FloatField(default=0, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Seek indexes for keyset pagination on the catalog sort orders.
+            models.Index(fields=["price", "id"], name="product_price_id_idx"),
+            models.Index(fields=["created_at", "id"], name="product_created_id_idx"),
+            models.Index(fields=["effective_price", "id"], name="product_effective_id_idx"),
+            models.Index(fields=["discount_pct", "id"], name="product_discount_pct_id_idx"),
+            # Catalog filters, see ecommerce.filters.ProductFilterSet.
+            models.Index(fields=["category", "id"], name="product_category_id_idx"),
+            models.Index(
+                fields=["id"],
+                condition=models.Q(available_quantity__gt=0),
+                name="product_in_stock_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.product_name
@@ -39,34 +173,98 @@ class Product(models.Model):
             check_slug = Product.objects.filter(slug=self.slug)
             if check_slug:
                 self.slug += "-{num}".format(num=str(random.randrange(1, 100)))
+        self.sync_pricing()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and any(
+            field in update_fields for field in PRICING_FIELDS
+        ):
+            kwargs["update_fields"] = set(update_fields) | set(DERIVED_PRICING_FIELDS)
         super().save(*args, **kwargs)
 
+    def sync_pricing(self):
+        self.effective_price = self.price - self.discount
+        self.discount_pct = self.discount * 100.0 / self.price if self.price > 0 else 0.0
+
+
+class CatalogFacet(models.Model):
+    # Facet counts for the whole catalog, maintained incrementally on product
+    # writes; see ecommerce.facets.
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["facet", "value"], name="unique_catalog_facet"),
+        ]
+
+    def __str__(self):
+        return "{facet}={value}".format(facet=self.facet, value=self.value)
+
 
 # Order Item -------
+MONEY_FIELD = DecimalField(max_digits=12, decimal_places=2)
+CENTS = Decimal("0.01")
+
+CartTotals = namedtuple("CartTotals", ["amount", "savings", "count"])
+
+
+def money_sum(expression):
+    # Sums in the database and casts to a 2-place decimal so callers work with
+    # exact amounts instead of accumulated floats.
+    total = Sum(ExpressionWrapper(expression, output_field=FloatField()))
+    return Coalesce(Cast(total, MONEY_FIELD), Value(0), output_field=MONEY_FIELD)
+
+
+class OrderItemQuerySet(models.QuerySet):
+    def cart(self, user):
+        return self.filter(user=user).select_related("product")
+
+    def cart_totals(self, user):
+        return self.filter(user=user).totals()
+
+    def totals(self):
+        totals = self.aggregate(
+            amount=money_sum(F("quantity") * F("product__effective_price")),
+            savings=money_sum(F("quantity") * F("product__discount")),
+            count=Coalesce(Sum("quantity"), Value(0)),
+        )
+        return CartTotals(
+            totals["amount"].quantize(CENTS),
+            totals["savings"].quantize(CENTS),
+            totals["count"],
+        )
+
+
+# Most units of one product a cart line may hold.
+MAX_LINE_QUANTITY = 5
+
+
 class OrderItem(models.Model):
+    # A line of a user's open cart. Checkout moves the lines into OrderLine,
+    # so this table only ever holds active carts.
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    order_id = models.CharField(max_length=10, blank=True, null=True)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     # product = models.IntegerField()
-    quantity = models.IntegerField()
-    is_ordered = models.BooleanField(default=False)
+    quantity = models.IntegerField(
+        validators=[MinValueValidator(1), MaxValueValidator(MAX_LINE_QUANTITY)]
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
-    def __str__(self):
-        return self.product.product_name
+    objects = OrderItemQuerySet.as_manager()
 
-    def total_cart_amount(self, *args, **kwargs):
-        order_items = OrderItem.objects.filter(
-            user=self.request.user, is_ordered=False
-        ).all()
-        total_amount = 0
-        total_savings = 0
-        for item in order_items:
-            total_amount += item.quantity * (item.product.price - item.product.discount)
-            total_savings += item.quantity * item.product.discount
-        return total_amount, total_savings
+    class Meta:
+        constraints = [
+            # Also serves the per-user cart lookups.
+            models.UniqueConstraint(fields=["user", "product"], name="unique_cart_line"),
+            models.CheckConstraint(
+                check=models.Q(quantity__gte=1, quantity__lte=MAX_LINE_QUANTITY),
+                name="cart_line_quantity_range",
+            ),
+        ]
 
-    # def cart_savings(self, *args, **kwargs):
+    def __str__(self):
+        return self.product.product_name
 
 
 class Address(models.Model):
@@ -88,7 +286,7 @@ class Address(models.Model):
 
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    order_id = models.CharField(max_length=10)
+    order_id = models.CharField(max_length=24, unique=True)
     total_amount = models.FloatField(default=0)
     total_items = models.IntegerField()
     coupon = models.CharField(max_length=10, blank=True, null=True)
@@ -100,8 +298,50 @@ class Order(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Order history: newest first, id breaks ties for keyset pages.
+            models.Index(
+                fields=["user", "-created_at", "-id"], name="order_user_created_id_idx"
+            ),
+        ]
+
+
+class OrderLine(models.Model):
+    # Append-only history of what was bought, written once at checkout. The
+    # product is snapshotted so order reads never touch the product table.
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="lines")
+    product = models.ForeignKey(
+        Product, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    quantity = models.IntegerField()
+    product_name = models.CharField(max_length=255)
+    product_slug = models.SlugField(max_length=255, blank=True, null=True)
+    product_image = models.CharField(max_length=100, blank=True)
+    unit_price = models.FloatField()
+    unit_discount = models.FloatField()
+    line_total = models.FloatField()
+
+    def __str__(self):
+        return self.product_name
+
+
+class OrderIdWorker(models.Model):
+    # One row per snowflake worker id; a process leases a row before it
+    # generates order ids, see ecommerce.ids.
+    worker_id = models.IntegerField(primary_key=True)
+    holder = models.CharField(max_length=100, blank=True)
+    renewed_at = models.DateTimeField(null=True, blank=True)
+
 
 class Wishlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "product"], name="unique_wishlist_product"
+            ),
+        ]
@@ -1,14 +1,93 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .cache import catalog_version, normalized_query
 
 
 DEFAULT_PAGE = 1
 DEFAULT_PAGE_SIZE = 4  #Change this
+MAX_PAGE_SIZE = 100
+
+# Query parameters that change which page is returned, or its order, but not
+# how many rows match.
+NON_COUNT_PARAMS = ("page", "page_size", "cursor", "pagination", "count", "ordering")
+
+
+def planner_estimate(queryset):
+    # PostgreSQL's row estimate costs no more than planning the query; other
+    # backends have no cheap estimate.
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql":
+        match = re.search(r"rows=(\d+)", queryset.explain())
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def estimate_count(queryset):
+    estimate = planner_estimate(queryset)
+    return queryset.count() if estimate is None else estimate
+
+
+def count_cache_key(request):
+    return "catalog:count:{version}:{digest}".format(
+        version=catalog_version(), digest=normalized_query(request, NON_COUNT_PARAMS)
+    )
+
+
+def cached_count(queryset, cache_key):
+    count = cache.get(cache_key)
+    if count is None:
+        threshold = settings.PRODUCT_COUNT_ESTIMATE_THRESHOLD
+        if threshold is not None:
+            count = planner_estimate(queryset)
+        if count is None or count <= threshold:
+            count = queryset.count()
+        cache.set(cache_key, count, settings.PRODUCT_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+    # Shares one COUNT(*) between all pages of the same filtered listing. The
+    # key includes the catalog version, which every committed product write
+    # bumps; see ecommerce.cache.invalidate_products.
+    def __init__(self, object_list, per_page, cache_key=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+
+    @cached_property
+    def count(self):
+        if self.cache_key is None:
+            return super().count
+        return cached_count(self.object_list, self.cache_key)
+
 
 class CustomPagination(PageNumberPagination):
     page = DEFAULT_PAGE
     page_size = DEFAULT_PAGE_SIZE
     page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_cache_key = count_cache_key(request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def django_paginator_class(self, queryset, page_size):
+        return CachedCountPaginator(queryset, page_size, cache_key=self.count_cache_key)
 
     def get_paginated_response(self, data):
         return Response({
@@ -18,7 +97,158 @@ class CustomPagination(PageNumberPagination):
             },
             'total_items': self.page.paginator.count,
             'page': int(self.request.GET.get('page', DEFAULT_PAGE)), # can not set default = self.page
-            'page_size': int(self.request.GET.get('page_size', self.page_size)),
+            'page_size': self.get_page_size(self.request),
             'total_pages': self.page.paginator.num_pages,
             'results': data
-        })
\ No newline at end of file
+        })
+
+
+class KeysetPagination(BasePagination):
+    # Seeks past the last row of the previous page instead of using OFFSET, so
+    # every page costs the same. Rows are ordered by one of `ordering_fields`
+    # with `id` as the tie-breaker; the position is carried in an opaque cursor.
+    page_size = DEFAULT_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = MAX_PAGE_SIZE
+    cursor_query_param = "cursor"
+    ordering_query_param = "ordering"
+    count_query_param = "count"
+    ordering_fields = ("id",)
+    default_ordering = "id"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_ordering(request)
+        self.total_items = self.get_count(queryset, request)
+        cursor = self.decode_cursor(request, queryset.model)
+
+        forward = cursor is None or cursor[2]
+        queryset = queryset.order_by(*self.get_order_by(reverse=not forward))
+        if cursor is not None:
+            queryset = queryset.filter(self.get_position_filter(cursor))
+
+        rows = list(queryset[: self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if forward:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        else:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        self.rows = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        response = {
+            "links": {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+            },
+            "page_size": self.page_size,
+            "results": data,
+        }
+        if self.total_items is not None:
+            response["total_items"] = self.total_items
+        return Response(response)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, "")
+        ordering = ordering.split(",")[0].strip()
+        if ordering.lstrip("-") not in self.ordering_fields:
+            ordering = self.default_ordering
+        return ordering.lstrip("-"), ordering.startswith("-")
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == "exact":
+            return cached_count(queryset, count_cache_key(request))
+        if mode == "estimate":
+            return estimate_count(queryset)
+        return None
+
+    def get_order_by(self, reverse=False):
+        descending = self.descending != reverse
+        prefix = "-" if descending else ""
+        if self.field == "id":
+            return (prefix + "id",)
+        return (prefix + self.field, prefix + "id")
+
+    def get_position_filter(self, cursor):
+        value, pk, forward = cursor
+        after = "lt" if self.descending == forward else "gt"
+        if self.field == "id":
+            return Q(**{"id__" + after: pk})
+        return Q(**{self.field + "__" + after: value}) | Q(
+            **{self.field: value, "id__" + after: pk}
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[-1], forward=True)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[0], forward=False)
+
+    def encode_cursor(self, row, forward):
+        value = self.row_value(row, self.field)
+        if hasattr(value, "isoformat"):
+            # Full precision; a truncated timestamp would skip or repeat rows.
+            value = value.isoformat()
+        position = [value, self.row_value(row, "id"), forward]
+        token = json.dumps(position, separators=(",", ":"))
+        token = urlsafe_b64encode(token.encode()).decode().rstrip("=")
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request, model):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            token = urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            value, pk, forward = json.loads(token)
+            value = model._meta.get_field(self.field).to_python(value)
+            pk = int(pk)
+        except (BinasciiError, TypeError, ValueError, ValidationError):
+            raise NotFound("Invalid cursor")
+        return value, pk, bool(forward)
+
+    @staticmethod
+    def row_value(row, field):
+        # Rows are model instances, or dicts when the view paginates .values().
+        if isinstance(row, dict):
+            return row[field]
+        return getattr(row, field)
+
+
+KEYSET_COLUMNS = ("id", "price", "effective_price", "discount_pct", "created_at")
+
+
+class ProductKeysetPagination(KeysetPagination):
+    ordering_fields = KEYSET_COLUMNS
+
+
+class OrderKeysetPagination(KeysetPagination):
+    # Order history, newest first; served by order_user_created_id_idx.
+    page_size = 10
+    ordering_fields = ("created_at",)
+    default_ordering = "-created_at"
+
+    def get_count(self, queryset, request):
+        # Counts are per user, so they are neither cached nor estimated.
+        if request.query_params.get(self.count_query_param) in ("exact", "estimate"):
+            return queryset.count()
+        return None
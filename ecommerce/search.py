@@ -0,0 +1,173 @@
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from django.db.models import FloatField
+from rest_framework.filters import SearchFilter
+
+from .models import SEARCH_FIELDS, Product
+from .pagination import cached_count, count_cache_key
+
+
+# Full-text search over the product catalog: an FTS5 virtual table on SQLite,
+# kept in sync by signals and the bulk writes of ProductQuerySet, and an
+# expression GIN index on PostgreSQL.
+SEARCH_COLUMNS = SEARCH_FIELDS
+FTS_TABLE = "ecommerce_product_fts"
+PG_SEARCH_INDEX = "product_search_idx"
+PG_DOCUMENT = "to_tsvector('english', {columns})".format(
+    columns=" || ' ' || ".join(
+        "coalesce(\"ecommerce_product\".\"{column}\", '')".format(column=column)
+        for column in SEARCH_COLUMNS
+    )
+)
+
+# Scoring is paid for every match, not just the page shown, so searches with
+# more matches than this are returned unranked.
+SEARCH_RANK_LIMIT = 1000
+
+REINDEX_BATCH_SIZE = 500
+
+_fts_tables = set()
+
+
+def search_tokens(terms):
+    return re.findall(r"\w+", terms.lower())
+
+
+def has_fts_table(using="default"):
+    # Only aliases where the table was found are remembered, so one created by
+    # migrations after the first check is still picked up.
+    if using in _fts_tables:
+        return True
+    connection = connections[using]
+    if connection.vendor == "sqlite" and FTS_TABLE in connection.introspection.table_names():
+        _fts_tables.add(using)
+        return True
+    return False
+
+
+def rebuild_search_index(using="default"):
+    # Rebuilds the whole index, e.g. after loading a fixture or a dump.
+    reindex_products(None, using)
+
+
+def reindex_products(pks, using="default"):
+    # Reindexes the given products from their stored rows, or all of them
+    # when pks is None.
+    if not has_fts_table(using):
+        return
+    sql = "INSERT INTO {table} (rowid, {columns}) SELECT id, {values} FROM ecommerce_product".format(
+        table=FTS_TABLE,
+        columns=", ".join(SEARCH_COLUMNS),
+        values=", ".join("coalesce({0}, '')".format(c) for c in SEARCH_COLUMNS),
+    )
+    with connections[using].cursor() as cursor:
+        if pks is None:
+            cursor.execute("DELETE FROM {table}".format(table=FTS_TABLE))
+            cursor.execute(sql)
+            return
+        pks = list(pks)
+        # Batched to stay under SQLite's limit on query parameters.
+        for start in range(0, len(pks), REINDEX_BATCH_SIZE):
+            batch = pks[start:start + REINDEX_BATCH_SIZE]
+            params = ", ".join(["%s"] * len(batch))
+            cursor.execute(
+                "DELETE FROM {table} WHERE rowid IN ({params})".format(
+                    table=FTS_TABLE, params=params
+                ),
+                batch,
+            )
+            cursor.execute(sql + " WHERE id IN ({params})".format(params=params), batch)
+
+
+def index_product(product, using="default"):
+    if not has_fts_table(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM {table} WHERE rowid = %s".format(table=FTS_TABLE), [product.pk]
+        )
+        cursor.execute(
+            "INSERT INTO {table} (rowid, {columns}) VALUES (%s, {params})".format(
+                table=FTS_TABLE,
+                columns=", ".join(SEARCH_COLUMNS),
+                params=", ".join(["%s"] * len(SEARCH_COLUMNS)),
+            ),
+            [product.pk] + [getattr(product, c) or "" for c in SEARCH_COLUMNS],
+        )
+
+
+def unindex_product(product, using="default"):
+    if not has_fts_table(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM {table} WHERE rowid = %s".format(table=FTS_TABLE), [product.pk]
+        )
+
+
+def search_products(queryset, terms):
+    # Returns the matching products annotated with `search_rank`, where lower
+    # is more relevant, or None when no full-text index is available.
+    tokens = search_tokens(terms)
+    if not tokens:
+        return queryset
+    if has_fts_table(queryset.db):
+        # Every token must match, as a prefix, in any of the columns. The FTS
+        # table is joined, rather than probed per row, so that the MATCH
+        # drives the query and bm25 ranks are read off the same rows.
+        match = " ".join('"{0}"*'.format(token) for token in tokens)
+        return queryset.extra(
+            select={"search_rank": "{table}.rank".format(table=FTS_TABLE)},
+            tables=[FTS_TABLE],
+            where=[
+                "{table}.rowid = ecommerce_product.id".format(table=FTS_TABLE),
+                "{table} MATCH %s".format(table=FTS_TABLE),
+            ],
+            params=[match],
+        )
+    if connections[queryset.db].vendor == "postgresql":
+        query = "to_tsquery('english', %s)"
+        params = (" & ".join(token + ":*" for token in tokens),)
+        return queryset.filter(
+            id__in=RawSQL(
+                "SELECT id FROM ecommerce_product WHERE {document} @@ {query}".format(
+                    document=PG_DOCUMENT, query=query
+                ),
+                params,
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                "-ts_rank({document}, {query})".format(document=PG_DOCUMENT, query=query),
+                params,
+                output_field=FloatField(),
+            )
+        )
+    return None
+
+
+class ProductSearchFilter(SearchFilter):
+    # Full-text search with relevance ordering; falls back to SearchFilter's
+    # LIKE lookups on `search_fields` when no search index is available.
+    #
+    # Searches with more matches than SEARCH_RANK_LIMIT are not ranked at all,
+    # as scoring is paid for every match, and come back in id order instead.
+    # `view.search_ranked` records whether the results are in relevance order.
+    def filter_queryset(self, request, queryset, view):
+        terms = request.query_params.get(self.search_param, "")
+        if not terms.strip() or queryset.model is not Product:
+            return super().filter_queryset(request, queryset, view)
+        view.search_ranked = False
+        results = search_products(queryset, terms)
+        if results is None:
+            return super().filter_queryset(request, queryset, view)
+        if "ordering" in request.query_params or results is queryset:
+            return results
+        # The same count the paginator reports, so it is cached and shared.
+        limit = getattr(settings, "SEARCH_RANK_LIMIT", SEARCH_RANK_LIMIT)
+        if cached_count(results, count_cache_key(request)) > limit:
+            return results.order_by("id")
+        view.search_ranked = True
+        return results.order_by("search_rank", "id")
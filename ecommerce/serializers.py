@@ -1,15 +1,34 @@
+from functools import lru_cache
+
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from .models import Product, OrderItem, Address, Order, Wishlist
 from django.conf import settings
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    # Accepts `fields=[...]` to serialize only a subset of the declared fields.
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = "__all__"
         # lookup_field = "slug"
 
 
+class ProductListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = ["id", "product_name", "slug", "price", "discount", "image1"]
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product_obj = ProductSerializer(required=False, read_only=True)
 
@@ -26,6 +45,31 @@ class OrderItemSerializer(serializers.ModelSerializer):
     #     order_item.user = self.request.user
 
 
+class CartOperationSerializer(serializers.Serializer):
+    # One step of a batch cart mutation; the product is given by id or slug.
+    OPS = ("add", "set", "remove")
+
+    op = serializers.ChoiceField(choices=OPS)
+    product_id = serializers.IntegerField(required=False)
+    slug = serializers.SlugField(required=False)
+    quantity = serializers.IntegerField(required=False, min_value=0)
+
+    def validate(self, data):
+        if "product_id" not in data and "slug" not in data:
+            raise serializers.ValidationError("Either product_id or slug is required")
+        if data["op"] != "remove" and "quantity" not in data:
+            raise serializers.ValidationError("quantity is required")
+        if data["op"] == "add" and data["quantity"] < 1:
+            raise serializers.ValidationError("quantity must be at least 1")
+        return data
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = serializers.ListField(
+        child=CartOperationSerializer(), allow_empty=False, max_length=100
+    )
+
+
 class AddressSerializer(serializers.ModelSerializer):
     class Meta:
         model = Address
@@ -43,23 +87,88 @@ class AddressSerializer(serializers.ModelSerializer):
         ]
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = "__all__"
 
 
-class WishlistSerializer(serializers.ModelSerializer):
+class WishlistSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Reads wishlist.product from the view's select_related; the nested list
+    # serializer is built once per request rather than once per row.
     product_image = serializers.SerializerMethodField("get_product_image")
-    product_detail = serializers.SerializerMethodField("get_product_detail")
+    product_detail = ProductListSerializer(source="product", read_only=True)
 
     def get_product_image(self, wishlist):
         return settings.DOMAIN_NAME + "/media/" + str(wishlist.product.image1)
 
-    def get_product_detail(self, wishlist):
-        product = wishlist.product
-        return ProductSerializer(product).data
-
     class Meta:
         model = Wishlist
-        fields = ["id", "product", "product_image", "product_detail"]
\ No newline at end of file
+        fields = ["id", "product", "product_image", "product_detail"]
+
+
+class ValuesSerializer:
+    # Read-only fast path for ModelSerializers over plain model fields: rows
+    # come from .values() and are converted with a field mapping compiled once
+    # per serializer class, skipping per-instance serializer and field setup.
+    # The output matches serializer_class(instance).data exactly.
+    def __init__(self, serializer_class, fields=None):
+        serializer = serializer_class(fields=fields)
+        model = serializer.Meta.model
+        self.columns = []
+        self.converters = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            source = field.source
+            if source == "*" or "." in source:
+                raise ValueError("Cannot compile field {name}".format(name=name))
+            model_field = model._meta.get_field(source)
+            with_request = False
+            if isinstance(field, serializers.FileField):
+                converter = self.file_converter(field, model_field)
+                with_request = True
+            elif isinstance(field, serializers.RelatedField):
+                source = model_field.attname
+                converter = None
+            else:
+                converter = field.to_representation
+            self.columns.append(source)
+            self.converters.append((name, source, converter, with_request))
+
+    @staticmethod
+    def file_converter(field, model_field):
+        use_url = getattr(field, "use_url", api_settings.UPLOADED_FILES_USE_URL)
+        storage = model_field.storage
+
+        def convert(name, request):
+            if not name:
+                return None
+            if not use_url:
+                return name
+            url = storage.url(name)
+            if request is not None:
+                return request.build_absolute_uri(url)
+            return url
+
+        return convert
+
+    def to_representation(self, row, request=None):
+        data = {}
+        for name, source, converter, with_request in self.converters:
+            value = row[source]
+            if value is None or converter is None:
+                data[name] = value
+            elif with_request:
+                data[name] = converter(value, request)
+            else:
+                data[name] = converter(value)
+        return data
+
+    def serialize(self, rows, request=None):
+        return [self.to_representation(row, request) for row in rows]
+
+
+@lru_cache(maxsize=64)
+def compiled_values_serializer(serializer_class, fields=None):
+    return ValuesSerializer(serializer_class, fields)
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import facets, suggest
+from .cache import invalidate_products
+from .models import Product
+from .search import index_product, unindex_product
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, using, **kwargs):
+    facets.remember(instance, using)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, using, **kwargs):
+    index_product(instance, using)
+    facets.product_saved(instance, using)
+    invalidate_products(
+        [instance.pk],
+        [instance.slug],
+        using,
+        lambda previous, version: suggest.product_saved(instance, previous, version),
+    )
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, using, **kwargs):
+    unindex_product(instance, using)
+    facets.product_deleted(instance, using)
+    # The collector clears instance.pk once the delete finishes.
+    pk = instance.pk
+    invalidate_products(
+        [pk],
+        [instance.slug],
+        using,
+        lambda previous, version: suggest.product_deleted(pk, previous, version),
+    )
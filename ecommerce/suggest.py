@@ -0,0 +1,134 @@
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+from .cache import catalog_version
+from .models import Product
+
+
+# In-process typeahead index over product names and tags: a sorted array of
+# (term, product id) pairs searched with bisect. It is built on first use and
+# patched from Product signals; when another process changes the catalog the
+# version check below triggers a rebuild.
+SUGGEST_CHECK_INTERVAL = 5
+
+
+def suggest_terms(name, tags):
+    name = name.lower()
+    terms = {name}
+    terms.update(re.findall(r"\w+", name))
+    for tag in (tags or "").lower().split(","):
+        tag = tag.strip()
+        if tag:
+            terms.add(tag)
+    return terms
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = []
+        self._entries = {}
+        self._terms = {}
+        self.version = None
+        self.checked_at = 0
+
+    def add(self, pk, slug, name, image, tags):
+        with self._lock:
+            self.remove(pk)
+            terms = suggest_terms(name, tags)
+            self._entries[pk] = (slug, name, image)
+            self._terms[pk] = terms
+            for term in terms:
+                insort(self._keys, (term, pk))
+
+    def remove(self, pk):
+        with self._lock:
+            for term in self._terms.pop(pk, ()):
+                position = bisect_left(self._keys, (term, pk))
+                if position < len(self._keys) and self._keys[position] == (term, pk):
+                    del self._keys[position]
+            self._entries.pop(pk, None)
+
+    def load(self, rows, version):
+        entries = {}
+        terms = {}
+        keys = []
+        for pk, slug, name, image, tags in rows:
+            entries[pk] = (slug, name, image)
+            terms[pk] = suggest_terms(name, tags)
+            keys.extend((term, pk) for term in terms[pk])
+        keys.sort()
+        with self._lock:
+            self._keys, self._entries, self._terms = keys, entries, terms
+            self.version = version
+
+    def lookup(self, prefix, limit):
+        prefix = prefix.lower().strip()
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            position = bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(results) < limit:
+                term, pk = self._keys[position]
+                if not term.startswith(prefix):
+                    break
+                if pk not in seen:
+                    seen.add(pk)
+                    results.append(self._entries[pk])
+                position += 1
+        return results
+
+    def reset(self):
+        with self._lock:
+            self._keys, self._entries, self._terms = [], {}, {}
+            self.version = None
+
+    def __len__(self):
+        return len(self._entries)
+
+
+product_index = PrefixIndex()
+
+
+def ensure_current(index=product_index):
+    # Checking the shared catalog version costs a cache round trip, so it is
+    # done at most every SUGGEST_CHECK_INTERVAL seconds.
+    now = time.monotonic()
+    interval = getattr(settings, "SUGGEST_CHECK_INTERVAL", SUGGEST_CHECK_INTERVAL)
+    if index.version is not None and now - index.checked_at < interval:
+        return
+    version = catalog_version()
+    if version != index.version:
+        index.load(
+            Product.objects.values_list("id", "slug", "product_name", "image1", "tags")
+            .iterator(),
+            version,
+        )
+    index.checked_at = now
+
+
+def suggest(prefix, limit):
+    ensure_current()
+    return product_index.lookup(prefix, limit)
+
+
+def product_saved(product, previous_version, version, index=product_index):
+    if index.version is None:
+        return
+    index.add(product.pk, product.slug, product.product_name, str(product.image1), product.tags)
+    if index.version == previous_version:
+        index.version = version
+
+
+def product_deleted(pk, previous_version, version, index=product_index):
+    if index.version is None:
+        return
+    index.remove(pk)
+    if index.version == previous_version:
+        index.version = version
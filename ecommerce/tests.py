@@ -1,3 +1,1335 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.utils import timezone
+from unittest import mock
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 
-# Create your tests here.
+from .api import ProductListView
+from .cache import CATALOG_VERSION_KEY, ProductCache, bump_catalog_version
+from .cart import (
+    CartError,
+    InvalidQuantity,
+    NotEnoughStock,
+    QuantityLimit,
+    UnknownProduct,
+    add_to_cart,
+    checkout,
+    order_line,
+)
+from .facets import catalog_facets, facet_counts
+from .ids import NoWorkerId, SnowflakeGenerator, WorkerLease, next_order_id
+from .models import (
+    CATEGORY_CHOICES,
+    MAX_LINE_QUANTITY,
+    Product,
+    OrderItem,
+    Address,
+    Order,
+    OrderIdWorker,
+    OrderLine,
+    Wishlist,
+)
+from .serializers import ProductSerializer, ProductListSerializer, ValuesSerializer
+from .suggest import product_index
+
+
+def make_product(name, price=100.0, discount=10.0, **kwargs):
+    kwargs.setdefault("category", "Mobile Phones")
+    kwargs.setdefault("available_quantity", 10)
+    kwargs.setdefault("short_desc", name)
+    kwargs.setdefault("description", name)
+    return Product.objects.create(
+        product_name=name,
+        price=price,
+        discount=discount,
+        **kwargs
+    )
+
+
+def run_commit_hooks():
+    # TestCase never commits, so run what transaction.on_commit() has queued
+    # the way a real commit would.
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
+
+def make_address(user):
+    return Address.objects.create(
+        user=user,
+        first_name="Test",
+        last_name="User",
+        line1="Line 1",
+        landmark="Landmark",
+        zip_code=795001,
+        state="Manipur",
+        country="India",
+        mobile="9999999999",
+    )
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("shopper", "shopper@example.com", "pass")
+        self.client = APIClient(HTTP_HOST="testserver")
+        self.client.force_authenticate(self.user)
+
+
+class CartItemsViewTests(APITestCase):
+    def test_cart_lines_and_totals(self):
+        phone = make_product("Phone", price=199.99, discount=20.5)
+        tablet = make_product("Tablet", price=50.0, discount=0)
+        OrderItem.objects.create(user=self.user, product=phone, quantity=2)
+        OrderItem.objects.create(user=self.user, product=tablet, quantity=1)
+        OrderItem.objects.create(
+            user=User.objects.create_user("someone-else"), product=tablet, quantity=3
+        )
+
+        response = self.client.get("/api/cart-items/")
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data["cartItems"]), 2)
+        self.assertEqual(data["cartItems"][0]["total_price"], 358.98)
+        self.assertEqual(
+            data["cartItems"][0]["image"], "http://testserver/media/default.jpg"
+        )
+        self.assertEqual(data["cartTotal"], 408.98)
+        self.assertEqual(data["cartSavings"], 41.0)
+        self.assertEqual(data["cartCount"], 3)
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        for i in range(10):
+            product = make_product("Product %d" % i)
+            OrderItem.objects.create(user=self.user, product=product, quantity=1)
+
+        # One joined query for the lines, one aggregate for the totals.
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/cart-items/")
+        self.assertEqual(len(response.json()["cartItems"]), 10)
+
+
+class CartTotalsTests(APITestCase):
+    def test_totals_are_exact_decimals(self):
+        for price, discount, quantity in ((0.1, 0.0, 3), (19.99, 0.33, 5), (5.0, 1.25, 1)):
+            product = make_product("%s" % price, price=price, discount=discount)
+            OrderItem.objects.create(user=self.user, product=product, quantity=quantity)
+
+        totals = OrderItem.objects.cart_totals(self.user)
+
+        self.assertEqual(totals.amount, Decimal("102.35"))
+        self.assertEqual(totals.savings, Decimal("2.90"))
+        self.assertEqual(totals.count, 9)
+
+    def test_empty_cart(self):
+        totals = OrderItem.objects.cart_totals(self.user)
+        self.assertEqual(totals, (Decimal("0.00"), Decimal("0.00"), 0))
+
+
+class AddToCartTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product("Phone", available_quantity=4)
+
+    def add(self, quantity, slug="phone"):
+        return self.client.post(
+            "/api/add-to-cart/", {"slug": slug, "quantity": quantity}, format="json"
+        )
+
+    def test_adds_to_the_open_line(self):
+        self.assertEqual(self.add(1).status_code, 201)
+        response = self.add(2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["quantity"], 3)
+        self.assertEqual(OrderItem.objects.get().quantity, 3)
+
+    def test_limits(self):
+        self.assertEqual(self.add(0).json()["message"], InvalidQuantity.message)
+        self.assertEqual(self.add("two").json()["message"], InvalidQuantity.message)
+        self.assertEqual(self.add(5).json()["message"], NotEnoughStock.message)
+        self.assertEqual(self.add(3).status_code, 201)
+        self.assertEqual(self.add(2).json()["message"], NotEnoughStock.message)
+        Product.objects.filter(pk=self.product.pk).update(available_quantity=100)
+        self.assertEqual(self.add(3).json()["message"], QuantityLimit.message)
+        self.assertEqual(self.add(2).status_code, 201)
+        self.assertEqual(OrderItem.objects.get().quantity, 5)
+        self.assertEqual(self.add(1, slug="nope").status_code, 400)
+
+    def test_database_rejects_oversized_open_lines(self):
+        line = OrderItem.objects.create(user=self.user, product=self.product, quantity=5)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OrderItem.objects.filter(pk=line.pk).update(quantity=6)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OrderItem.objects.filter(pk=line.pk).update(quantity=0)
+
+
+class CartBatchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.phone = make_product("Phone", price=100.0, discount=10.0)
+        self.tablet = make_product("Tablet", price=200.0, discount=0.0)
+        self.laptop = make_product("Laptop", price=500.0, discount=50.0)
+
+    def batch(self, *operations):
+        return self.client.post(
+            "/api/cart-batch/", {"operations": list(operations)}, format="json"
+        )
+
+    def quantities(self):
+        return dict(
+            OrderItem.objects.values_list("product__slug", "quantity")
+        )
+
+    def test_add_set_and_remove_in_one_request(self):
+        OrderItem.objects.create(user=self.user, product=self.phone, quantity=1)
+        OrderItem.objects.create(user=self.user, product=self.laptop, quantity=2)
+        response = self.batch(
+            {"op": "add", "slug": "phone", "quantity": 2},
+            {"op": "add", "product_id": self.tablet.pk, "quantity": 1},
+            {"op": "add", "slug": "tablet", "quantity": 1},
+            {"op": "remove", "product_id": self.laptop.pk},
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.quantities(), {"phone": 3, "tablet": 2})
+        data = response.json()
+        self.assertEqual(data["cartCount"], 5)
+        self.assertEqual(data["cartTotal"], 670.0)
+        self.assertEqual(data["cartSavings"], 30.0)
+        self.assertEqual(len(data["cartItems"]), 2)
+
+        self.batch({"op": "set", "slug": "phone", "quantity": 0},
+                   {"op": "set", "slug": "tablet", "quantity": 5})
+        self.assertEqual(self.quantities(), {"tablet": 5})
+
+    def test_invalid_batches_change_nothing(self):
+        OrderItem.objects.create(user=self.user, product=self.phone, quantity=4)
+        for operations, message in (
+            ([{"op": "add", "slug": "tablet", "quantity": 1},
+              {"op": "add", "slug": "phone", "quantity": 2}], QuantityLimit.message),
+            ([{"op": "add", "slug": "tablet", "quantity": 1},
+              {"op": "remove", "slug": "nope"}], UnknownProduct.message),
+        ):
+            self.assertEqual(self.batch(*operations).json()["message"], message)
+        self.assertEqual(self.batch({"op": "set", "slug": "phone"}).status_code, 400)
+        self.assertEqual(self.batch({"op": "swap", "slug": "phone"}).status_code, 400)
+        self.assertEqual(self.batch().status_code, 400)
+        self.assertEqual(self.quantities(), {"phone": 4})
+
+    def test_statements_do_not_grow_with_the_batch(self):
+        products = [make_product("Gadget %d" % i) for i in range(20)]
+        OrderItem.objects.bulk_create(
+            OrderItem(user=self.user, product=product, quantity=1) for product in products[:10]
+        )
+        operations = [
+            {"op": "add", "product_id": product.pk, "quantity": 1} for product in products[5:]
+        ] + [{"op": "remove", "product_id": product.pk} for product in products[:5]]
+        # Products, locked lines, delete, bulk update, bulk insert, the cart
+        # and its totals, inside one savepoint.
+        with self.assertNumQueries(9):
+            self.assertEqual(self.batch(*operations).status_code, 200)
+        self.assertEqual(set(self.quantities().values()), {1, 2})
+        self.assertEqual(len(self.quantities()), 15)
+
+
+class AddToCartConcurrencyTests(TransactionTestCase):
+    threads = 12
+
+    def hammer(self, product, users):
+        # Every thread adds one unit as close to simultaneously as possible.
+        barrier = threading.Barrier(len(users))
+        outcomes = []
+
+        def worker(user):
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        add_to_cart(user, product, 1)
+                        outcomes.append("added")
+                        return
+                    except CartError as e:
+                        outcomes.append(type(e).__name__)
+                        return
+                    except OperationalError as e:
+                        # SQLite reports lock conflicts between connections
+                        # instead of waiting on them; try again.
+                        if "locked" not in str(e):
+                            raise
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_no_lost_increments_or_duplicate_lines(self):
+        user = User.objects.create_user("shopper")
+        product = make_product("Phone", available_quantity=100)
+        outcomes = self.hammer(product, [user] * self.threads)
+        self.assertEqual(outcomes.count("added"), MAX_LINE_QUANTITY)
+        self.assertEqual(outcomes.count("QuantityLimit"), self.threads - MAX_LINE_QUANTITY)
+        line = OrderItem.objects.get(user=user, product=product)
+        self.assertEqual(line.quantity, MAX_LINE_QUANTITY)
+
+    def test_many_shoppers_share_one_product(self):
+        users = [User.objects.create_user("shopper-%d" % i) for i in range(self.threads)]
+        product = make_product("Phone", available_quantity=100)
+        outcomes = self.hammer(product, users)
+        self.assertEqual(outcomes, ["added"] * self.threads)
+        self.assertEqual(
+            sorted(OrderItem.objects.values_list("user", "quantity")),
+            [(user.pk, 1) for user in users],
+        )
+
+
+class OrderViewTests(APITestCase):
+    def test_checkout_moves_cart_into_order(self):
+        phone = make_product("Phone", price=199.99, discount=20.5)
+        OrderItem.objects.create(user=self.user, product=phone, quantity=2)
+        address = make_address(self.user)
+
+        response = self.client.post(
+            "/api/order/",
+            {"address_id": address.id, "coupon": "INSTANT10"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get()
+        self.assertEqual(order.total_items, 2)
+        self.assertEqual(order.total_amount, 399.98)
+        self.assertEqual(order.coupon_amount, 35.9)
+        self.assertEqual(order.order_amount, 323.08)
+        self.assertEqual(order.savings, 76.9)
+        self.assertFalse(OrderItem.objects.cart(self.user).exists())
+        line = OrderLine.objects.get(order=order)
+        self.assertEqual((line.product_id, line.quantity), (phone.pk, 2))
+        self.assertEqual(
+            (line.product_name, line.product_slug, line.product_image),
+            ("Phone", "phone", "default.jpg"),
+        )
+        self.assertEqual((line.unit_price, line.unit_discount), (199.99, 20.5))
+        self.assertAlmostEqual(line.line_total, 358.98)
+        phone.refresh_from_db()
+        self.assertEqual(phone.available_quantity, 8)
+
+    def test_empty_cart_is_rejected(self):
+        address = make_address(self.user)
+        response = self.client.post(
+            "/api/order/", {"address_id": address.id}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_unknown_addresses_are_rejected(self):
+        OrderItem.objects.create(user=self.user, product=make_product("Phone"), quantity=1)
+        other = make_address(User.objects.create_user("someone-else"))
+        for address_id in (None, other.id, "home", [1]):
+            response = self.client.post(
+                "/api/order/", {"address_id": address_id}, format="json"
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()["message"], "Address does not exist")
+        self.assertFalse(Order.objects.exists())
+
+    def test_out_of_stock_rolls_back_the_whole_checkout(self):
+        phone = make_product("Phone", available_quantity=5)
+        tablet = make_product("Tablet", available_quantity=1)
+        OrderItem.objects.create(user=self.user, product=phone, quantity=2)
+        OrderItem.objects.create(user=self.user, product=tablet, quantity=2)
+        address = make_address(self.user)
+
+        response = self.client.post(
+            "/api/order/", {"address_id": address.id}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(OrderItem.objects.cart(self.user).count(), 2)
+        phone.refresh_from_db()
+        self.assertEqual(phone.available_quantity, 5)
+
+    @override_settings(ORDER_ID_WORKER_ID=1)
+    def test_query_count_does_not_grow_with_cart_size(self):
+        address = make_address(self.user)
+        for i in range(10):
+            product = make_product("Product %d" % i)
+            OrderItem.objects.create(user=self.user, product=product, quantity=1)
+
+        # Address, savepoint pair, locked cart, totals, stock update and
+        # check, order insert, bulk line insert, cart delete.
+        with self.assertNumQueries(10):
+            response = self.client.post(
+                "/api/order/", {"address_id": address.id}, format="json"
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Order.objects.get().total_items, 10)
+
+
+class OrderHistoryTests(APITestCase):
+    def place_order(self, user, created_at, lines=2):
+        order = Order.objects.create(
+            user=user,
+            order_id=next_order_id(),
+            total_items=lines,
+            address=make_address(user),
+        )
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        OrderLine.objects.bulk_create(
+            order_line(
+                order,
+                OrderItem(product=make_product("%s line %d" % (order.order_id, i)), quantity=1),
+            )
+            for i in range(lines)
+        )
+        return order
+
+    def test_history_is_paginated_newest_first(self):
+        orders = [
+            self.place_order(self.user, "2021-01-%02dT00:00:00Z" % day) for day in range(1, 8)
+        ]
+        self.place_order(User.objects.create_user("someone-else"), "2021-02-01T00:00:00Z")
+        data = self.client.get("/api/all-orders/?count=exact").json()
+        self.assertEqual(data["total_items"], 7)
+        seen = []
+        url = "/api/all-orders/?page_size=3"
+        while url:
+            with self.assertNumQueries(1):
+                data = self.client.get(url).json()
+            seen += [row["order_id"] for row in data["results"]]
+            url = data["links"]["next"]
+        self.assertEqual(seen, [order.order_id for order in reversed(orders)])
+
+    def test_detail_takes_two_queries(self):
+        order = self.place_order(self.user, "2021-01-01T00:00:00Z", lines=5)
+        with self.assertNumQueries(2):
+            data = self.client.get("/api/order/%s/" % order.order_id).json()
+        self.assertEqual(len(data["order_items"]), 5)
+        self.assertEqual(data["address"]["id"], order.address_id)
+        self.assertEqual(data["order_items"][0]["total_price"], 90.0)
+
+    def test_detail_shows_the_product_as_it_was_bought(self):
+        order = self.place_order(self.user, "2021-01-01T00:00:00Z", lines=1)
+        Product.objects.update(price=500.0, discount=0.0, product_name="Renamed")
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get("/api/order/%s/" % order.order_id).json()
+        self.assertNotIn("ecommerce_product", " ".join(q["sql"] for q in queries))
+        line = data["order_items"][0]
+        self.assertEqual(line["product_name"], "%s line 0" % order.order_id)
+        self.assertEqual((line["price"], line["discount"], line["total_price"]), (100.0, 10.0, 90.0))
+        self.assertEqual(line["image"], "http://testserver/media/default.jpg")
+
+    def test_history_outlives_the_product(self):
+        order = self.place_order(self.user, "2021-01-01T00:00:00Z", lines=1)
+        Product.objects.all().delete()
+        data = self.client.get("/api/order/%s/" % order.order_id).json()
+        self.assertEqual(data["order_items"][0]["product_name"], "%s line 0" % order.order_id)
+        self.assertIsNone(OrderLine.objects.get().product_id)
+
+    def test_detail_without_address(self):
+        order = self.place_order(self.user, "2021-01-01T00:00:00Z")
+        order.address.delete()
+        data = self.client.get("/api/order/%s/" % order.order_id).json()
+        self.assertIsNone(data["address"])
+        other = User.objects.create_user("someone-else")
+        order = self.place_order(other, "2021-01-01T00:00:00Z")
+        response = self.client.get("/api/order/%s/" % order.order_id)
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderIdTests(TestCase):
+    def test_ids_are_unique_and_increasing_within_a_millisecond(self):
+        generator = SnowflakeGenerator(worker_id=7, clock=lambda: 1700000000.0)
+        ids = [generator.next_id() for _ in range(10000)]
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_clock_moving_backwards_does_not_repeat_ids(self):
+        now = [1700000000.0]
+        generator = SnowflakeGenerator(worker_id=1, clock=lambda: now[0])
+        first = generator.next_id()
+        now[0] -= 5
+        self.assertGreater(generator.next_id(), first)
+
+    def test_workers_do_not_collide(self):
+        clock = lambda: 1700000000.0
+        a = SnowflakeGenerator(worker_id=1, clock=clock)
+        b = SnowflakeGenerator(worker_id=2, clock=clock)
+        ids = {a.next_id() for _ in range(100)} | {b.next_id() for _ in range(100)}
+        self.assertEqual(len(ids), 200)
+
+    def test_processes_with_pids_1024_apart_do_not_collide(self):
+        clock = lambda: 1700000000.0
+        generators = []
+        for pid in (5, 5 + 1024):
+            with mock.patch("os.getpid", return_value=pid):
+                generators.append(SnowflakeGenerator(WorkerLease().worker_id(), clock=clock))
+        ids = {generator.next_id() for generator in generators for _ in range(100)}
+        self.assertEqual(len(ids), 200)
+
+    def test_leases_are_renewed_and_taken_over_once_expired(self):
+        now = [timezone.now()]
+        clock = lambda: now[0]
+        first = WorkerLease("first", lease_seconds=60, clock=clock)
+        worker_id = first.worker_id()
+        OrderIdWorker.objects.exclude(worker_id=worker_id).update(holder="busy", renewed_at=now[0])
+        with self.assertRaises(NoWorkerId):
+            WorkerLease("second", lease_seconds=60, clock=clock).worker_id()
+        now[0] += timedelta(seconds=45)
+        self.assertEqual(first.worker_id(), worker_id)
+        now[0] += timedelta(seconds=45)
+        second = WorkerLease("second", lease_seconds=60, clock=clock)
+        self.assertNotIn(second.worker_id(), (worker_id, None))
+
+    def test_a_lost_lease_is_replaced(self):
+        lease = WorkerLease("first")
+        worker_id = lease.worker_id()
+        OrderIdWorker.objects.filter(worker_id=worker_id).update(holder="second")
+        self.assertNotEqual(lease.worker_id(), worker_id)
+
+    def test_order_ids_sort_in_creation_order(self):
+        ids = [next_order_id() for _ in range(100)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(len(order_id) == 22 for order_id in ids))
+        self.assertTrue(all(order_id.startswith("ODR") for order_id in ids))
+
+
+class IndexUsageTests(APITestCase):
+    def assertUsesIndex(self, queryset):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+        plan = queryset.explain().upper()
+        self.assertIn("INDEX", plan)
+        # No full table scans and no sorting outside the index.
+        self.assertNotRegex(plan, r"SCAN \w+$|SCAN \w+\n|SEQ SCAN")
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def setUp(self):
+        super().setUp()
+        self.product = make_product("Phone")
+
+    def test_open_cart(self):
+        self.assertUsesIndex(OrderItem.objects.cart(self.user))
+
+    def test_open_cart_line_for_product(self):
+        queryset = OrderItem.objects.filter(user=self.user, product=self.product)
+        self.assertUsesIndex(queryset)
+
+    def test_order_history(self):
+        queryset = Order.objects.filter(user=self.user).order_by("-created_at", "-id")
+        self.assertUsesIndex(queryset)
+
+    def test_order_lines(self):
+        queryset = OrderLine.objects.filter(order_id=1)
+        self.assertUsesIndex(queryset)
+
+    def test_wishlist_entry(self):
+        queryset = Wishlist.objects.filter(user=self.user, product=self.product)
+        self.assertUsesIndex(queryset)
+
+    def test_effective_price_range(self):
+        queryset = Product.objects.filter(
+            effective_price__gte=50, effective_price__lte=150
+        ).order_by("effective_price", "id")
+        self.assertUsesIndex(queryset.values("id", "effective_price"))
+
+    def test_category_filter(self):
+        queryset = Product.objects.filter(category="Tablets").order_by("id")
+        self.assertUsesIndex(queryset.values("id"))
+
+    def test_in_stock_filter(self):
+        queryset = Product.objects.filter(available_quantity__gt=0).order_by("id")
+        self.assertUsesIndex(queryset.values("id"))
+
+    def test_biggest_discount_first(self):
+        queryset = Product.objects.order_by("-discount_pct", "-id")
+        self.assertUsesIndex(queryset.values("id", "discount_pct"))
+
+
+class ProductPricingTests(APITestCase):
+    def assertPricing(self, product, effective_price, discount_pct):
+        product.refresh_from_db()
+        self.assertAlmostEqual(product.effective_price, effective_price)
+        self.assertAlmostEqual(product.discount_pct, discount_pct)
+
+    def test_save_keeps_derived_columns_in_sync(self):
+        product = make_product("Phone", price=200.0, discount=50.0)
+        self.assertPricing(product, 150.0, 25.0)
+        product.discount = 20.0
+        product.save(update_fields=["discount"])
+        self.assertPricing(product, 180.0, 10.0)
+
+    def test_queryset_update(self):
+        product = make_product("Phone", price=200.0, discount=50.0)
+        Product.objects.update(discount=F("discount") + 30)
+        self.assertPricing(product, 120.0, 40.0)
+        Product.objects.update(price=400.0)
+        self.assertPricing(product, 320.0, 20.0)
+        Product.objects.update(price=0.0, discount=0.0)
+        self.assertPricing(product, 0.0, 0.0)
+
+    def test_bulk_create_and_bulk_update(self):
+        Product.objects.bulk_create([
+            Product(product_name="Phone", slug="phone", short_desc="Phone",
+                    description="Phone", category="Mobile Phones", price=50.0,
+                    discount=5.0, available_quantity=1),
+        ])
+        product = Product.objects.get(slug="phone")
+        self.assertPricing(product, 45.0, 10.0)
+        product.price = 100.0
+        Product.objects.bulk_update([product], ["price"])
+        self.assertPricing(product, 95.0, 5.0)
+
+    def test_list_filters_and_orders_by_derived_columns(self):
+        make_product("Cheap", price=100.0, discount=10.0)
+        make_product("Deal", price=300.0, discount=150.0)
+        make_product("Pricey", price=500.0, discount=0.0)
+        data = self.client.get("/api/products-filter/?ordering=-discount_pct").json()
+        self.assertEqual([row["slug"] for row in data["results"]], ["deal", "cheap", "pricey"])
+        data = self.client.get(
+            "/api/products-filter/?effective_price__gte=100&effective_price__lte=200"
+            "&ordering=effective_price"
+        ).json()
+        self.assertEqual([row["slug"] for row in data["results"]], ["deal"])
+        data = self.client.get(
+            "/api/products-filter/?pagination=keyset&ordering=-discount_pct&page_size=2"
+        ).json()
+        self.assertEqual([row["slug"] for row in data["results"]], ["deal", "cheap"])
+        data = self.client.get(data["links"]["next"]).json()
+        self.assertEqual([row["slug"] for row in data["results"]], ["pricey"])
+
+
+class ProductFilterSetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        make_product("Phone", price=100.0, discount=0.0)
+        make_product("Tablet", price=300.0, discount=100.0, category="Tablets")
+        make_product("Laptop", price=900.0, discount=0.0, category="Laptops",
+                     available_quantity=0)
+
+    def slugs(self, query):
+        response = self.client.get("/api/products-filter/?ordering=price&" + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row["slug"] for row in response.json()["results"]]
+
+    def test_category_in(self):
+        self.assertEqual(self.slugs("category__in=Tablets,Laptops"), ["tablet", "laptop"])
+        self.assertEqual(self.slugs("category=Tablets"), ["tablet"])
+
+    def test_price_ranges(self):
+        self.assertEqual(self.slugs("price__gte=200&price__lte=400"), ["tablet"])
+        self.assertEqual(self.slugs("effective_price__lte=200"), ["phone", "tablet"])
+
+    def test_in_stock(self):
+        self.assertEqual(self.slugs("in_stock=true"), ["phone", "tablet"])
+        self.assertEqual(self.slugs("in_stock=false"), ["laptop"])
+
+    def test_created_after(self):
+        Product.objects.filter(slug="phone").update(created_at="2020-01-01T00:00:00Z")
+        self.assertEqual(
+            self.slugs("created_after=2021-01-01T00:00:00Z"), ["tablet", "laptop"]
+        )
+
+    def test_invalid_values_are_rejected(self):
+        response = self.client.get("/api/products-filter/?price__gte=cheap")
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogFacetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.phone = make_product("Phone", price=20000.0, discount=1000.0)
+        make_product("Tablet", price=800.0, discount=0.0, category="Tablets")
+        make_product("Laptop", price=60000.0, discount=0.0, category="Laptops")
+
+    def counts(self, facets):
+        return {
+            name: {row["value"]: row["count"] for row in rows if row["count"]}
+            for name, rows in facets.items()
+        }
+
+    def assertTableIsCurrent(self):
+        self.assertEqual(catalog_facets(), facet_counts(Product.objects.all()))
+
+    def test_facet_table_follows_product_writes(self):
+        self.assertEqual(
+            self.counts(catalog_facets()),
+            {
+                "category": {"Mobile Phones": 1, "Tablets": 1, "Laptops": 1},
+                "price": {"0-1000": 1, "10000-25000": 1, "50000+": 1},
+            },
+        )
+        self.phone.category = "Tablets"
+        self.phone.discount = 15000.0
+        self.phone.save()
+        self.assertTableIsCurrent()
+        self.phone.delete()
+        self.assertTableIsCurrent()
+        Product.objects.filter(category="Tablets").update(price=30000.0)
+        self.assertTableIsCurrent()
+        Product.objects.bulk_create([
+            Product(product_name="Camera", slug="camera", short_desc="Camera",
+                    description="Camera", category="Camera", price=5000.0,
+                    discount=0.0, available_quantity=1),
+        ])
+        self.assertTableIsCurrent()
+
+    def test_facets_of_the_whole_catalog(self):
+        data = self.client.get("/api/products-filter/?facets=1&page_size=1").json()
+        self.assertEqual(len(data["results"]), 1)
+        self.assertEqual(data["facets"], catalog_facets())
+        self.assertEqual(
+            [row["value"] for row in data["facets"]["category"]],
+            [value for value, _ in CATEGORY_CHOICES],
+        )
+        self.assertNotIn("facets", self.client.get("/api/products-filter/").json())
+
+    def test_facets_of_a_filtered_search(self):
+        data = self.client.get(
+            "/api/products-filter/?facets=1&category__in=Tablets,Laptops"
+        ).json()
+        self.assertEqual(
+            self.counts(data["facets"]),
+            {"category": {"Tablets": 1, "Laptops": 1}, "price": {"0-1000": 1, "50000+": 1}},
+        )
+        data = self.client.get("/api/products-filter/?facets=1&search=phone").json()
+        self.assertEqual(
+            self.counts(data["facets"]),
+            {"category": {"Mobile Phones": 1}, "price": {"10000-25000": 1}},
+        )
+
+    def test_filtered_facets_take_one_query(self):
+        with self.assertNumQueries(1):
+            facet_counts(Product.objects.filter(price__gte=1000).order_by("price"))
+
+
+class ProductKeysetPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # Repeated prices exercise the id tie-breaker.
+        self.products = [
+            make_product("Product %d" % i, price=float(i % 3)) for i in range(10)
+        ]
+
+    def walk(self, url):
+        ids = []
+        pages = 0
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(product["id"] for product in data["results"])
+            url = data["links"]["next"]
+            pages += 1
+        return ids, pages
+
+    def test_walks_every_product_once_in_order(self):
+        ids, pages = self.walk("/api/products-filter/?pagination=keyset&ordering=price")
+        expected = sorted(self.products, key=lambda product: (product.price, product.id))
+        self.assertEqual(ids, [product.id for product in expected])
+        self.assertEqual(pages, 3)
+
+    def test_descending_created_at(self):
+        ids, _ = self.walk(
+            "/api/products-filter/?pagination=keyset&ordering=-created_at&page_size=3"
+        )
+        self.assertEqual(ids, [product.id for product in reversed(self.products)])
+
+    def test_previous_link_returns_the_previous_page(self):
+        url = "/api/products-filter/?pagination=keyset&ordering=-price"
+        first = self.client.get(url).json()
+        second = self.client.get(first["links"]["next"]).json()
+        back = self.client.get(second["links"]["previous"]).json()
+        self.assertEqual(back["results"], first["results"])
+        self.assertIsNone(back["links"]["previous"])
+
+    def test_count_is_opt_in(self):
+        url = "/api/products-filter/?pagination=keyset&category=Mobile+Phones"
+        self.assertNotIn("total_items", self.client.get(url).json())
+        self.assertEqual(self.client.get(url + "&count=exact").json()["total_items"], 10)
+        self.assertEqual(
+            self.client.get(url + "&count=estimate").json()["total_items"], 10
+        )
+
+    def test_deep_pages_cost_one_query(self):
+        data = self.client.get("/api/products-filter/?pagination=keyset").json()
+        with self.assertNumQueries(1):
+            self.client.get(data["links"]["next"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/products-filter/?pagination=keyset&cursor=abc")
+        self.assertEqual(response.status_code, 404)
+
+
+class CachedCountTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(6):
+            make_product("Product %d" % i)
+
+    def test_count_is_shared_between_pages(self):
+        url = "/api/products-filter/?category=Mobile+Phones&search=Product"
+        self.assertEqual(self.client.get(url).json()["total_items"], 6)
+        # Only the page itself is fetched; param order does not matter.
+        with self.assertNumQueries(1):
+            data = self.client.get(
+                "/api/products-filter/?page=2&search=Product&category=Mobile+Phones"
+            ).json()
+        self.assertEqual(data["total_items"], 6)
+        self.assertEqual(len(data["results"]), 2)
+
+    def test_product_writes_invalidate_the_count(self):
+        url = "/api/products-filter/"
+        self.assertEqual(self.client.get(url).json()["total_items"], 6)
+        product = make_product("Another")
+        run_commit_hooks()
+        self.assertEqual(self.client.get(url).json()["total_items"], 7)
+        product.delete()
+        run_commit_hooks()
+        self.assertEqual(self.client.get(url).json()["total_items"], 6)
+
+    def test_stock_changes_invalidate_in_stock_counts(self):
+        url = "/api/products-filter/?in_stock=true"
+        self.assertEqual(self.client.get(url).json()["total_items"], 6)
+        Product.objects.filter(product_name="Product 0").update(available_quantity=0)
+        run_commit_hooks()
+        self.assertEqual(self.client.get(url).json()["total_items"], 5)
+
+        product = Product.objects.get(product_name="Product 1")
+        Product.objects.filter(pk=product.pk).update(available_quantity=5)
+        OrderItem.objects.create(user=self.user, product=product, quantity=5)
+        checkout(self.user, make_address(self.user))
+        run_commit_hooks()
+        self.assertEqual(self.client.get(url).json()["total_items"], 4)
+
+    def test_different_filters_are_counted_separately(self):
+        make_product("Tablet", category="Tablets")
+        self.assertEqual(self.client.get("/api/products-filter/").json()["total_items"], 7)
+        data = self.client.get("/api/products-filter/?category=Tablets").json()
+        self.assertEqual(data["total_items"], 1)
+
+
+class ProductSearchTests(APITestCase):
+    def search(self, terms, **params):
+        params["search"] = terms
+        params.setdefault("page_size", 50)
+        response = self.client.get("/api/products-filter/", params)
+        return [product["product_name"] for product in response.json()["results"]]
+
+    def test_matches_all_searchable_columns_by_prefix(self):
+        make_product("Apple iPhone 11")
+        make_product("Galaxy Tab", short_desc="Android tablet")
+        make_product("Surface", description="Detachable laptop by Microsoft")
+        make_product("Buds", tags="wireless,earbuds")
+        make_product("Unrelated")
+
+        self.assertEqual(self.search("iph"), ["Apple iPhone 11"])
+        self.assertEqual(self.search("android"), ["Galaxy Tab"])
+        self.assertEqual(self.search("microsoft laptop"), ["Surface"])
+        self.assertEqual(self.search("Wireless"), ["Buds"])
+        self.assertEqual(self.search("iphone android"), [])
+
+    def test_ranks_by_relevance_unless_ordering_is_given(self):
+        make_product("Case", price=5, description="Fits the pixel")
+        make_product("Pixel 4a Pixel", price=300, tags="pixel")
+        self.assertEqual(self.search("pixel"), ["Pixel 4a Pixel", "Case"])
+        self.assertEqual(self.search("pixel", ordering="price"), ["Case", "Pixel 4a Pixel"])
+
+    def test_broad_searches_are_returned_unranked(self):
+        make_product("Case", description="Fits the pixel")
+        make_product("Cover", description="Fits the pixel")
+        make_product("Pixel 4a Pixel", tags="pixel")
+        with self.settings(SEARCH_RANK_LIMIT=2):
+            data = self.client.get("/api/products-filter/?search=pixel&page_size=2").json()
+            self.assertFalse(data["ranked"])
+            self.assertEqual(self.search("pixel", page_size=2), ["Case", "Cover"])
+            self.assertEqual(self.search("pixel", page_size=2, page=2), ["Pixel 4a Pixel"])
+        cache.clear()
+        data = self.client.get("/api/products-filter/?search=pixel&page_size=2").json()
+        self.assertTrue(data["ranked"])
+        self.assertEqual(self.search("pixel", page_size=2), ["Pixel 4a Pixel", "Case"])
+        self.assertEqual(self.search("pixel", page_size=2, page=2), ["Cover"])
+
+    def test_index_follows_product_writes(self):
+        product = make_product("Old name", short_desc="Phone", description="Phone")
+        product.product_name = "New name"
+        product.save()
+        run_commit_hooks()
+        self.assertEqual(self.search("old"), [])
+        self.assertEqual(self.search("new"), ["New name"])
+        product.delete()
+        run_commit_hooks()
+        self.assertEqual(self.search("new"), [])
+
+    def test_index_follows_bulk_writes(self):
+        phone = make_product("Phone", short_desc="", description="")
+        Product.objects.bulk_create([
+            Product(product_name="Tablet", slug="tablet", short_desc="", description="",
+                    category="Tablets", price=10, discount=0, available_quantity=1),
+        ])
+        Product.objects.filter(pk=phone.pk).update(product_name="Handset")
+        tablet = Product.objects.get(slug="tablet")
+        tablet.tags = "slate"
+        Product.objects.bulk_update([tablet], ["tags"])
+        run_commit_hooks()
+        self.assertEqual(self.search("phone"), [])
+        self.assertEqual(self.search("handset"), ["Handset"])
+        self.assertEqual(self.search("slate"), ["Tablet"])
+
+    def test_punctuation_only_search_returns_everything(self):
+        make_product("Phone")
+        self.assertEqual(self.search('"*'), ["Phone"])
+
+
+class ProductSuggestTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        product_index.reset()
+        make_product("Apple iPhone 11", tags="smartphone,ios")
+        make_product("Apple iPad Air", image1="product_images/ipad-air1.png")
+        make_product("OnePlus 8", tags="smartphone")
+
+    def suggest(self, q, **params):
+        params["q"] = q
+        return self.client.get("/api/products-suggest/", params).json()["results"]
+
+    def test_matches_name_words_and_tags_by_prefix(self):
+        names = lambda results: sorted(r["product_name"] for r in results)
+        self.assertEqual(names(self.suggest("IP")), ["Apple iPad Air", "Apple iPhone 11"])
+        self.assertEqual(names(self.suggest("apple iph")), ["Apple iPhone 11"])
+        self.assertEqual(names(self.suggest("smart")), ["Apple iPhone 11", "OnePlus 8"])
+        self.assertEqual(self.suggest("zzz"), [])
+        self.assertEqual(len(self.suggest("a", limit=1)), 1)
+        self.assertEqual(len(self.suggest("a", limit=0)), 1)
+        self.assertEqual(len(self.suggest("a", limit=-1)), 1)
+
+    def test_returns_only_slug_name_and_thumbnail(self):
+        self.assertEqual(
+            self.suggest("ipad"),
+            [
+                {
+                    "slug": "apple-ipad-air",
+                    "product_name": "Apple iPad Air",
+                    "thumbnail": "http://testserver/media/product_images/ipad-air1.png",
+                }
+            ],
+        )
+
+    def test_product_writes_patch_the_index_without_reloading(self):
+        self.suggest("a")
+        product = make_product("Pixel 4a")
+        Product.objects.get(product_name="OnePlus 8").delete()
+        run_commit_hooks()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest("pix")[0]["slug"], product.slug)
+            self.assertEqual(self.suggest("oneplus"), [])
+
+    def test_reloads_when_the_catalog_changed_elsewhere(self):
+        self.suggest("a")
+        Product.objects.filter(product_name="OnePlus 8").update(product_name="Nord")
+        bump_catalog_version()
+        product_index.checked_at = 0
+        self.assertEqual(self.suggest("nord")[0]["product_name"], "Nord")
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product("Phone", tags="android")
+
+    def test_lists_use_the_compact_representation(self):
+        data = self.client.get("/api/products-filter/").json()
+        self.assertEqual(
+            sorted(data["results"][0]),
+            ["discount", "id", "image1", "price", "product_name", "slug"],
+        )
+        self.assertEqual(
+            sorted(self.client.get("/api/products/").json()["results"][0]),
+            ["discount", "id", "image1", "price", "product_name", "slug"],
+        )
+
+    def test_fields_parameter_on_lists_and_detail(self):
+        data = self.client.get("/api/products-filter/?fields=slug,description").json()
+        self.assertEqual(data["results"], [{"slug": "phone", "description": "Phone"}])
+        data = self.client.get("/api/products/phone/?fields=tags").json()
+        self.assertEqual(data, {"tags": "android"})
+        self.assertIn("description", self.client.get("/api/products/phone/").json())
+
+    def test_fields_parameter_on_wishlist_and_orders(self):
+        Wishlist.objects.create(user=self.user, product=self.product)
+        data = self.client.get("/api/wishlist/").json()
+        self.assertNotIn("description", data[0]["product_detail"])
+        data = self.client.get("/api/wishlist/?fields=id,product").json()
+        self.assertEqual(sorted(data[0]), ["id", "product"])
+
+        Order.objects.create(
+            user=self.user,
+            order_id="ODR1",
+            total_items=1,
+            address=make_address(self.user),
+        )
+        data = self.client.get("/api/all-orders/?fields=order_id,total_items").json()
+        self.assertEqual(data["results"], [{"order_id": "ODR1", "total_items": 1}])
+        data = self.client.get("/api/order/ODR1/?fields=order_id").json()
+        self.assertEqual(data["order"], {"order_id": "ODR1"})
+
+
+class WishlistTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = [make_product("Phone %d" % i) for i in range(5)]
+        self.entries = [
+            Wishlist.objects.create(user=self.user, product=product)
+            for product in self.products[:3]
+        ]
+
+    def test_list_is_one_joined_query(self):
+        with self.assertNumQueries(1):
+            data = self.client.get("/api/wishlist/").json()
+        self.assertEqual([row["product"] for row in data], [p.pk for p in self.products[:3]])
+        self.assertEqual(
+            sorted(data[0]["product_detail"]),
+            ["discount", "id", "image1", "price", "product_name", "slug"],
+        )
+
+    def test_membership_of_many_products_in_one_query(self):
+        other = User.objects.create_user("someone-else")
+        Wishlist.objects.create(user=other, product=self.products[4])
+        ids = ",".join(str(product.pk) for product in self.products)
+        with self.assertNumQueries(1):
+            data = self.client.get("/api/wishlist/contains/?product_ids=" + ids).json()
+        self.assertEqual(
+            data["results"],
+            [{"id": entry.pk, "product": entry.product_id} for entry in self.entries],
+        )
+        response = self.client.get("/api/wishlist/contains/?product_ids=1,x")
+        self.assertEqual(response.status_code, 400)
+
+    def test_delete_is_scoped_to_the_owner(self):
+        other = User.objects.create_user("someone-else")
+        foreign = Wishlist.objects.create(user=other, product=self.products[0])
+        response = self.client.delete("/api/wishlist/%d/" % foreign.pk)
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(Wishlist.objects.filter(pk=foreign.pk).exists())
+        with self.assertNumQueries(1):
+            response = self.client.delete("/api/wishlist/%d/" % self.entries[0].pk)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Wishlist.objects.filter(pk=self.entries[0].pk).exists())
+
+    def test_adding_twice_is_a_validation_error(self):
+        response = self.client.post(
+            "/api/wishlist/", {"product": self.products[0].pk}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            "/api/wishlist/", {"product": self.products[4].pk}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+
+
+class ProductListViewTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        for i in range(7):
+            make_product("Phone %d" % i, price=100.0 + i)
+
+    def test_catalog_is_paginated(self):
+        data = self.client.get("/api/products/").json()
+        self.assertEqual(data["total_items"], 7)
+        self.assertEqual(data["page_size"], 4)
+        self.assertEqual([row["slug"] for row in data["results"]],
+                         ["phone-0", "phone-1", "phone-2", "phone-3"])
+        data = self.client.get("/api/products/?page_size=1000").json()
+        self.assertEqual(data["page_size"], 100)
+        self.assertEqual(len(data["results"]), 7)
+
+    def test_export_streams_the_whole_catalog_in_chunks(self):
+        expected = self.client.get("/api/products/?page_size=100").json()["results"]
+        with mock.patch.object(ProductListView, "export_chunk_size", 3):
+            response = self.client.get("/api/products/?export=1")
+            self.assertTrue(response.streaming)
+            chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(b"".join(chunks)), expected)
+        self.assertIsNone(cache.get("catalog:response:" + response["ETag"].strip('"')))
+
+    def test_export_of_an_empty_catalog(self):
+        Product.objects.all().delete()
+        response = self.client.get("/api/products/?export=1&fields=slug")
+        self.assertEqual(b"".join(response.streaming_content), b"[]")
+
+
+class ValuesSerializerTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        make_product("Phone", price=199.99, discount=0.5, tags="android")
+        make_product("Tablet", image1="product_images/ipda-1.png", image2="")
+        make_product("Laptop", image2="product_images/MPro2.png", tags=None)
+        self.request = Request(APIRequestFactory().get("/", HTTP_HOST="testserver"))
+
+    def assertSameOutput(self, serializer_class, fields=None):
+        products = Product.objects.order_by("id")
+        kwargs = {} if fields is None else {"fields": fields}
+        expected = serializer_class(
+            products, many=True, context={"request": self.request}, **kwargs
+        ).data
+        fast = ValuesSerializer(serializer_class, fields)
+        rows = products.values(*fast.columns)
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(fast.serialize(rows, self.request)),
+            renderer.render(expected),
+        )
+        # Without a request image urls stay relative, as with DRF.
+        self.assertEqual(
+            renderer.render(fast.serialize(rows)),
+            renderer.render(serializer_class(products, many=True, **kwargs).data),
+        )
+
+    def test_byte_identical_to_model_serializers(self):
+        self.assertSameOutput(ProductSerializer)
+        self.assertSameOutput(ProductListSerializer)
+        self.assertSameOutput(ProductSerializer, fields=("slug", "image2", "created_at"))
+
+    def test_list_endpoints_use_values_rows(self):
+        response = self.client.get("/api/products-filter/?ordering=price")
+        products = Product.objects.order_by("price")[:4]
+        expected = ProductListSerializer(
+            products, many=True, context={"request": response.wsgi_request}
+        ).data
+        self.assertEqual(response.json()["results"], expected)
+
+
+class ProductCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product("Phone")
+        self.cache = ProductCache()
+
+    def test_detail_endpoint_is_served_from_cache(self):
+        self.client.get("/api/products/phone/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/products/phone/")
+        self.assertEqual(response.json()["product_name"], "Phone")
+        self.assertEqual(self.client.get("/api/products/nope/").status_code, 404)
+
+    def test_hits_misses_and_invalidation(self):
+        self.assertEqual(self.cache.get_by_slug("phone"), self.product)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get_by_id(self.product.pk).product_name, "Phone")
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 2})
+
+        self.product.product_name = "Renamed"
+        self.product.save()
+        run_commit_hooks()
+        self.assertEqual(self.cache.get_by_slug("phone").product_name, "Renamed")
+
+        self.product.delete()
+        run_commit_hooks()
+        self.assertIsNone(self.cache.get_by_slug("phone"))
+
+    def test_slug_changes_are_followed(self):
+        self.cache.get_by_slug("phone")
+        self.product.slug = "phone-2"
+        self.product.save()
+        run_commit_hooks()
+        self.assertIsNone(self.cache.get_by_slug("phone"))
+        self.assertEqual(self.cache.get_by_slug("phone-2"), self.product)
+        replacement = make_product("Phone")
+        run_commit_hooks()
+        self.assertEqual(self.cache.get_by_slug("phone"), replacement)
+
+    def test_recompute_racing_an_invalidation_is_not_served(self):
+        pk = self.product.pk
+        stale_key = "product:%d:%d" % (pk, self.cache.version(pk))
+        stale = Product.objects.get(pk=pk)
+        self.product.product_name = "Renamed"
+        self.product.save()
+        run_commit_hooks()
+        # A slow recompute that read the old row finishes after the write.
+        self.cache.store(stale_key, stale)
+        self.assertEqual(self.cache.get_by_id(pk).product_name, "Renamed")
+
+    def stock(self):
+        return self.client.get("/api/products/phone/").json()["available_quantity"]
+
+    def test_writes_invalidate_only_once_committed(self):
+        self.assertEqual(self.stock(), 10)
+        Product.objects.filter(pk=self.product.pk).update(available_quantity=7)
+        # A read before the commit must not cache the old row again under
+        # the new version.
+        self.assertEqual(self.stock(), 10)
+        run_commit_hooks()
+        self.assertEqual(self.stock(), 7)
+
+    def test_checkout_invalidates_the_products_bought(self):
+        self.assertEqual(self.stock(), 10)
+        OrderItem.objects.create(user=self.user, product=self.product, quantity=5)
+        response = self.client.post(
+            "/api/order/", {"address_id": make_address(self.user).id}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        run_commit_hooks()
+        self.assertEqual(self.stock(), 5)
+
+    def test_bulk_writes_invalidate(self):
+        self.assertEqual(self.stock(), 10)
+        self.product.available_quantity = 3
+        Product.objects.bulk_update([self.product], ["available_quantity"])
+        run_commit_hooks()
+        self.assertEqual(self.stock(), 3)
+
+        self.assertEqual(self.client.get("/api/products/tablet/").status_code, 404)
+        Product.objects.bulk_create([
+            Product(
+                product_name="Tablet", slug="tablet", short_desc="Tablet",
+                description="Tablet", category="Tablets", price=100, discount=0,
+                available_quantity=1,
+            )
+        ])
+        run_commit_hooks()
+        self.assertEqual(self.client.get("/api/products/tablet/").status_code, 200)
+
+    def test_concurrent_misses_load_once(self):
+        calls = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.05)
+            return "value"
+
+        threads = [
+            threading.Thread(target=self.cache.fetch, args=("single-flight", loader))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.cache.fetch("single-flight", loader), "value")
+
+
+class ProductCacheCommitTests(TransactionTestCase):
+    def test_checkout_commit_invalidates_the_cached_product(self):
+        cache.clear()
+        user = User.objects.create_user("shopper")
+        client = APIClient(HTTP_HOST="testserver")
+        client.force_authenticate(user)
+        product = make_product("Phone")
+        self.assertEqual(client.get("/api/products/phone/").json()["available_quantity"], 10)
+        OrderItem.objects.create(user=user, product=product, quantity=5)
+        client.post("/api/order/", {"address_id": make_address(user).id}, format="json")
+        self.assertEqual(client.get("/api/products/phone/").json()["available_quantity"], 5)
+
+
+class CatalogResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient(HTTP_HOST="testserver")
+        self.product = make_product("Phone")
+
+    def test_cached_responses_and_conditional_gets_skip_the_database(self):
+        for url in (
+            "/api/products/",
+            "/api/products-filter/?category=Mobile+Phones&ordering=price",
+            "/api/products/phone/",
+        ):
+            response = self.client.get(url)
+            etag = response["ETag"]
+            self.assertEqual(response["Cache-Control"], "public, no-cache")
+            with self.assertNumQueries(0):
+                cached = self.client.get(url)
+                not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(cached.content, response.content)
+            self.assertEqual(cached["ETag"], etag)
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified.content, b"")
+
+    def test_etag_depends_on_normalized_query_and_catalog_version(self):
+        first = self.client.get("/api/products-filter/?ordering=price&page=1")
+        same = self.client.get("/api/products-filter/?page=1&ordering=price")
+        other = self.client.get("/api/products-filter/?page=1")
+        self.assertEqual(first["ETag"], same["ETag"])
+        self.assertNotEqual(first["ETag"], other["ETag"])
+
+        self.product.price = 1
+        self.product.save()
+        run_commit_hooks()
+        response = self.client.get(
+            "/api/products-filter/?ordering=price&page=1", HTTP_IF_NONE_MATCH=first["ETag"]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertEqual(response.json()["results"][0]["price"], 1.0)
+
+    def set_catalog_version(self, seconds_ago):
+        cache.set(CATALOG_VERSION_KEY, int((time.time() - seconds_ago) * 1000), None)
+
+    def test_if_modified_since(self):
+        self.set_catalog_version(5)
+        response = self.client.get("/api/products/")
+        last_modified = response["Last-Modified"]
+        response = self.client.get("/api/products/", HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Last-Modified"], last_modified)
+
+    def test_last_modified_waits_for_the_version_second_to_end(self):
+        # A second write within this second would keep the same value.
+        self.set_catalog_version(0)
+        response = self.client.get("/api/products/")
+        self.assertNotIn("Last-Modified", response)
+        response = self.client.get(
+            "/api/products/", HTTP_IF_MODIFIED_SINCE="Thu, 01 Jan 2099 00:00:00 GMT"
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_wildcards_and_dates_do_not_hide_missing_products(self):
+        self.set_catalog_version(5)
+        for headers in (
+            {"HTTP_IF_NONE_MATCH": "*"},
+            {"HTTP_IF_MODIFIED_SINCE": "Thu, 01 Jan 2099 00:00:00 GMT"},
+        ):
+            response = self.client.get("/api/products/nope/", **headers)
+            self.assertEqual(response.status_code, 404)
+            response = self.client.get("/api/products/phone/", **headers)
+            self.assertEqual(response.status_code, 304)
+
+    def test_stock_changes_change_the_etag(self):
+        url = "/api/products-filter/?in_stock=true"
+        first = self.client.get(url)
+        Product.objects.filter(pk=self.product.pk).update(available_quantity=5)
+        run_commit_hooks()
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()["results"][0]["id"], self.product.pk)
+
+        user = User.objects.create_user("shopper")
+        OrderItem.objects.create(user=user, product=self.product, quantity=5)
+        checkout(user, make_address(user))
+        run_commit_hooks()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=second["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], [])
+
+    def test_errors_are_not_cached(self):
+        self.assertEqual(self.client.get("/api/products/nope/").status_code, 404)
+        make_product("Nope")
+        run_commit_hooks()
+        self.assertEqual(self.client.get("/api/products/nope/").status_code, 200)
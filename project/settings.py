@@ -52,7 +52,7 @@ INSTALLED_APPS = [
 ]
 
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': ('knox.auth.TokenAuthentication',),
+    'DEFAULT_AUTHENTICATION_CLASSES': ('accounts.auth.CachedTokenAuthentication',),
     # 'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     # 'PAGE_SIZE': 4
 }
@@ -100,6 +100,51 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Upper bounds, in seconds, for the catalog caches: products behind the detail
+# endpoint, rendered public responses and COUNT(*)s per filter. Every product
+# write, checkout and bulk queryset writes included, invalidates them as soon
+# as its transaction commits (ecommerce.cache.invalidate_products).
+PRODUCT_CACHE_TIMEOUT = 3600
+CATALOG_RESPONSE_CACHE_TIMEOUT = 300
+PRODUCT_COUNT_CACHE_TIMEOUT = 300
+
+# Above this many rows page-number pagination reports the planner's estimate
+# instead of an exact COUNT(*). None always counts exactly.
+PRODUCT_COUNT_ESTIMATE_THRESHOLD = None
+
+# Verified knox tokens kept per process by accounts.auth, and for how many
+# seconds; logout and token expiry evict them earlier, in other processes
+# through markers in the default cache, which must then be shared.
+AUTH_TOKEN_CACHE_SIZE = 1024
+AUTH_TOKEN_CACHE_TTL = 60
+
+AUTHENTICATION_BACKENDS = ['accounts.backends.EmailBackend']
+
+PASSWORD_HASHERS = [
+    'accounts.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+# PBKDF2 work factor for new and rehashed passwords. Leave unset for Django's
+# default; lower it for test and load environments only. Existing passwords are
+# rehashed to the configured cost when their owners next log in.
+PASSWORD_HASH_ITERATIONS = (
+    int(os.environ["PASSWORD_HASH_ITERATIONS"])
+    if "PASSWORD_HASH_ITERATIONS" in os.environ
+    else None
+)
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -134,6 +179,15 @@ USE_TZ = True
 
 DOMAIN_NAME = "http://localhost:8000"
 
+# Worker id (0-1023) for order id generation. Leave unset to lease one from the
+# database per process; if set, it must be set and distinct for every process.
+ORDER_ID_WORKER_ID = (
+    int(os.environ["ORDER_ID_WORKER_ID"]) if "ORDER_ID_WORKER_ID" in os.environ else None
+)
+# Seconds a leased worker id stays reserved without being renewed. Keep it well
+# above any clock skew between hosts.
+ORDER_ID_WORKER_LEASE = 3600
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 